@@ -0,0 +1,278 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from PIL import Image, ImageDraw
+from streamlit import logger as st_logger
+
+import main as app
+
+WORDS = "hello there how are you doing today I am happy sad angry scared surprised great news".split()
+EMOTIONS = ["joy", "sadness", "anger", "fear", "surprise", "disgust", "neutral"]
+
+def synthetic_text(length, seed=0):
+    rng = random.Random(seed)
+    words = []
+    while sum(len(w) + 1 for w in words) < length:
+        words.append(rng.choice(WORDS))
+    return " ".join(words)[:length]
+
+def stub_emotion_detector(texts, batch_size=1, **kwargs):
+    return [{'label': EMOTIONS[len(text) % len(EMOTIONS)], 'score': 1.0} for text in texts]
+
+def install_synthetic_assets(directory):
+    # Photo-like noise so JPEG/PNG decode and LANCZOS resize cost resembles real assets
+    rng = random.Random(0)
+    backgrounds = []
+    for i in range(3):
+        path = os.path.join(directory, f"bg-{i+1}.jpg")
+        Image.effect_noise((1600, 1200), 40 + i * 10).convert('RGB').save(path, quality=90)
+        backgrounds.append(path)
+    characters = {}
+    for gender in ("male", "female"):
+        for emotion in EMOTIONS:
+            path = os.path.join(directory, f"{gender}_{emotion}.png")
+            img = Image.new('RGBA', (600, 800), (0, 0, 0, 0))
+            draw = ImageDraw.Draw(img)
+            color = tuple(rng.randrange(256) for _ in range(3)) + (255,)
+            draw.ellipse([100, 50, 500, 450], fill=color)
+            draw.rectangle([200, 450, 400, 780], fill=color)
+            img.save(path)
+            characters[f"{gender}_{emotion}"] = path
+    app.BACKGROUND_IMAGES = backgrounds
+    app.CHARACTER_IMAGES = characters
+    app.get_asset_cache().clear()
+    # Also packed, so loose files and the memory-mapped pack can be compared
+    global PACK_PATH
+    PACK_PATH = os.path.join(directory, "assets.pack")
+    app.build_asset_pack(directory, PACK_PATH)
+    use_asset_pack(None)
+
+def use_asset_pack(path):
+    app.ASSET_PACK = path or ""
+    app.get_asset_pack.clear()
+
+def message_pair(length, seed=0):
+    return [("User A", synthetic_text(length, seed), EMOTIONS[seed % len(EMOTIONS)]),
+            ("User B", synthetic_text(length, seed + 1), EMOTIONS[(seed + 1) % len(EMOTIONS)])]
+
+GENDERS = {'User A': 'male', 'User B': 'female'}
+PACK_PATH = None
+
+def expect_cache_hits(fn, counter, items):
+    # A warm case only measures the cache if the cache outlives the call (bench runs without a Streamlit script)
+    counters = app.get_metrics().snapshot()['counters']
+    before = counters.get(counter, 0)
+    fn()
+    hits = app.get_metrics().snapshot()['counters'].get(counter, 0) - before
+    if hits < items:
+        raise RuntimeError(f"warm run counted {hits} {counter} events, expected {items}")
+
+def build_cases():
+    # (name, params, setup) where setup() returns (fn, items_per_call); setup runs outside the timed region
+    cases = []
+    for length in (10, 100, 500):
+        cases.append(("create_speech_bubble", {'chars': length},
+                      lambda length=length: (lambda text=synthetic_text(length): app.create_speech_bubble(text, 300), 1)))
+        def loose(length=length):
+            use_asset_pack(None)
+            return (lambda pair=message_pair(length): app.create_comic_page(pair, 0, GENDERS), 1)
+        def packed(length=length):
+            use_asset_pack(PACK_PATH)
+            return (lambda pair=message_pair(length): app.create_comic_page(pair, 0, GENDERS), 1)
+        cases.append(("create_comic_page", {'chars': length}, loose))
+        cases.append(("create_comic_page_packed", {'chars': length}, packed))
+    for count in (1, 10, 50):
+        for encoding in app.PDF_PAGE_ENCODINGS:
+            def setup(count=count, encoding=encoding):
+                use_asset_pack(None)
+                pages = [app.create_comic_page(message_pair(80, i), i, GENDERS) for i in range(count)]
+                return (lambda: app.create_comic_pdf(pages, encoding=encoding), count)
+            cases.append(("create_comic_pdf", {'pages': count, 'encoding': encoding}, setup))
+        def vector(count=count):
+            use_asset_pack(None)
+            pairs = [message_pair(80, i) for i in range(count)]
+            return (lambda: app.create_comic_pdf_vector(pairs, GENDERS), count)
+        cases.append(("create_comic_pdf", {'pages': count, 'encoding': 'vector'}, vector))
+    for width, height in ((400, 300), (800, 600), (800, 1000), (2400, 3000)):
+        for mode in ('vertical', 'radial'):
+            def cold(width=width, height=height, mode=mode):
+                def run():
+                    app.clear_gradient_cache()
+                    return app.create_gradient_background(width, height, app.get_color_scheme('birthday'), mode)
+                return (run, 1)
+            def warm(width=width, height=height, mode=mode):
+                colors = app.get_color_scheme('birthday')
+                stops = app.gradient_stops(colors)
+                if app._render_gradient(width, height, stops, mode) is not app._render_gradient(width, height, stops, mode):
+                    raise RuntimeError("gradient cache does not keep entries between calls")
+                return (lambda: app.create_gradient_background(width, height, colors, mode), 1)
+            cases.append(("create_gradient_background", {'size': f"{width}x{height}", 'mode': mode, 'cache': 'cold'}, cold))
+            cases.append(("create_gradient_background", {'size': f"{width}x{height}", 'mode': mode, 'cache': 'warm'}, warm))
+    for notes in (0, 200, 1000):
+        data = {'event_type': 'Birthday Party', 'event_name': "Sam's 30th", 'date_time': 'Sat 7 PM',
+                'venue': '123 Main Street', 'host_name': 'Alex', 'additional_notes': synthetic_text(notes)}
+        cases.append(("generate_invitation_card", {'notes_chars': notes},
+                      lambda data=data: (lambda: app.generate_invitation_card(data), 1)))
+        wishes = {'festival_name': 'Diwali', 'sender_name': 'Alex', 'receiver_name': 'Sam',
+                  'personal_message': synthetic_text(notes)}
+        cases.append(("generate_wishes_card", {'message_chars': notes},
+                      lambda wishes=wishes: (lambda: app.generate_wishes_card(wishes), 1)))
+    for fmt in app.PRINT_FORMATS:
+        data = {'festival_name': 'Diwali', 'sender_name': 'Alex', 'receiver_name': 'Sam', 'personal_message': synthetic_text(200)}
+        cases.append(("render_print_card", {'paper': 'A6', 'dpi': 300, 'format': fmt},
+                      lambda data=data, fmt=fmt: (lambda: app.render_print_card('wishes', data, io.BytesIO(), fmt, 'A6', 300), 1)))
+    for batch in (1, 16, 64):
+        def cold(batch=batch):
+            texts = [synthetic_text(60, i) for i in range(batch)]
+            def run():
+                app.clear_emotion_cache()
+                return app.detect_emotions(texts)
+            return (run, batch)
+        def warm(batch=batch):
+            texts = [synthetic_text(60, i) for i in range(batch)]
+            app.detect_emotions(texts)
+            run = lambda: app.detect_emotions(texts)
+            expect_cache_hits(run, 'emotion_cache_hit', batch)
+            return (run, batch)
+        # The path chat messages take: concurrent submits to the shared batcher thread
+        def batched(batch=batch, cache='cold'):
+            texts = [synthetic_text(60, i) for i in range(batch)]
+            batcher = app.get_emotion_batcher()
+            def run():
+                if cache == 'cold':
+                    app.clear_emotion_cache()
+                return [future.result() for future in [batcher.submit(text) for text in texts]]
+            if cache == 'warm':
+                run()
+                expect_cache_hits(run, 'emotion_cache_hit', batch)
+            return (run, batch)
+        cases.append(("detect_emotion", {'texts': batch, 'cache': 'cold'}, cold))
+        cases.append(("detect_emotion", {'texts': batch, 'cache': 'warm'}, warm))
+        cases.append(("detect_emotion_batched", {'texts': batch, 'cache': 'cold'}, batched))
+        cases.append(("detect_emotion_batched", {'texts': batch, 'cache': 'warm'},
+                      lambda batch=batch: batched(batch, 'warm')))
+    return cases
+
+def case_id(name, params):
+    return name + "[" + ",".join(f"{k}={v}" for k, v in params.items()) + "]"
+
+def percentile(samples, q):
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, max(0, round(q / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+def max_rss_kb():
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / 1024 if sys.platform == 'darwin' else rss
+
+def measure(fn, items, repeat, warmup):
+    for _ in range(warmup):
+        fn()
+    samples = []
+    gc.collect()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    # Peak memory is taken on a separate call so tracemalloc overhead does not skew timings.
+    # tracemalloc only sees Python allocations (not Pillow's pixel buffers), so the process
+    # high-water mark is reported next to it
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    total = sum(samples)
+    return {
+        'repeat': repeat,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'p50_ms': percentile(samples, 50) * 1000,
+        'p90_ms': percentile(samples, 90) * 1000,
+        'p99_ms': percentile(samples, 99) * 1000,
+        'min_ms': min(samples) * 1000,
+        'throughput_per_s': (items * repeat / total) if total else float('inf'),
+        'peak_memory_kb': peak / 1024,
+        'max_rss_kb': max_rss_kb(),
+    }
+
+def compare(results, baseline, threshold):
+    base = {r['id']: r for r in baseline.get('results', [])}
+    regressions = []
+    for result in results:
+        previous = base.get(result['id'])
+        if not previous:
+            continue
+        ratio = result['p50_ms'] / previous['p50_ms'] if previous['p50_ms'] else 1.0
+        result['baseline_p50_ms'] = previous['p50_ms']
+        result['ratio'] = ratio
+        if ratio > 1 + threshold:
+            regressions.append(result)
+    return regressions
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Benchmark the comic and card rendering hot paths.")
+    parser.add_argument("--repeat", type=int, default=5, help="Timed runs per case")
+    parser.add_argument("--warmup", type=int, default=1, help="Untimed runs per case")
+    parser.add_argument("--filter", action="append", default=[], help="Only run cases whose id contains this text (repeatable)")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Compare against a previous --output file")
+    parser.add_argument("--threshold", type=float, default=0.2, help="Allowed p50 slowdown vs baseline (0.2 = 20%%)")
+    return parser
+
+def run(argv=None):
+    args = build_parser().parse_args(argv)
+    app.set_emotion_detector(stub_emotion_detector)
+    results = []
+    with tempfile.TemporaryDirectory() as assets_dir:
+        install_synthetic_assets(assets_dir)
+        for name, params, setup in build_cases():
+            cid = case_id(name, params)
+            if args.filter and not any(f in cid for f in args.filter):
+                continue
+            fn, items = setup()
+            result = {'id': cid, 'function': name, 'params': params}
+            result.update(measure(fn, items, args.repeat, args.warmup))
+            results.append(result)
+            print(f"{cid:<75} p50 {result['p50_ms']:9.2f} ms  p99 {result['p99_ms']:9.2f} ms  "
+                  f"{result['throughput_per_s']:10.1f}/s  peak {result['peak_memory_kb']:9.0f} KB")
+
+    regressions = []
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(results, json.load(f), args.threshold)
+        for result in regressions:
+            print(f"REGRESSION {result['id']}: p50 {result['p50_ms']:.2f} ms vs {result['baseline_p50_ms']:.2f} ms "
+                  f"({result['ratio']:.2f}x)", file=sys.stderr)
+
+    if args.output:
+        report = {
+            'created': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'results': results,
+        }
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    st_logger.set_log_level("error")
+    sys.exit(run())
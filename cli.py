@@ -0,0 +1,209 @@
+import argparse
+import contextlib
+import json
+import os
+import sys
+
+from streamlit import logger as st_logger
+
+import main as app
+
+def add_pool_arguments(parser):
+    parser.add_argument("--workers", type=int, default=app.RENDER_WORKERS, help="Parallel renderers (default: one per CPU)")
+    parser.add_argument("--executor", choices=["process", "thread"], default=app.RENDER_EXECUTOR)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Render comics and cards without Streamlit.")
+    parser.add_argument("--metrics", help="Write per-stage timings on exit: Prometheus text, or JSON if the path ends in .json")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    comic = commands.add_parser("comic", help="Render a chat transcript to comic pages")
+    comic.add_argument("transcript", help="JSON, CSV or WhatsApp-style .txt export")
+    comic.add_argument("--format", choices=app.TRANSCRIPT_FORMATS, help="Transcript format (default: from file extension)")
+    comic.add_argument("--speaker-a", help="Transcript name drawn as User A (default: first speaker)")
+    comic.add_argument("--speaker-b", help="Transcript name drawn as User B (default: second speaker)")
+    comic.add_argument("--gender-a", choices=["male", "female"], default="male")
+    comic.add_argument("--gender-b", choices=["male", "female"], default="female")
+    comic.add_argument("--out-dir", help="Write comic_page_N.png files here")
+    comic.add_argument("--pdf", help="Write the comic PDF to this path")
+    comic.add_argument("--pdf-encoding", choices=app.PDF_PAGE_ENCODINGS, default="lossless")
+    comic.add_argument("--pdf-quality", type=int, default=85, help="JPEG quality for --pdf-encoding jpeg")
+    comic.add_argument("--vector-text", action="store_true", help="Draw bubbles and text as vector PDF text (with --pdf only)")
+    comic.add_argument("--no-emotion", action="store_true", help="Skip emotion detection, use 'neutral' where missing")
+    add_pool_arguments(comic)
+
+    cards = commands.add_parser("cards", help="Render one personalized card per guest in a CSV")
+    cards.add_argument("guest_list", help="CSV with a name column plus optional notes or card fields")
+    cards.add_argument("--type", choices=["invitation", "wishes"], required=True)
+    cards.add_argument("--card", help="JSON file with the shared card fields (event_type, venue, festival_name, ...)")
+    cards.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE", help="Set a shared card field (repeatable)")
+    cards.add_argument("--out", required=True, help="Output .zip of PNGs or multi-page .pdf")
+    cards.add_argument("--vector-text", action="store_true", help="Write the .pdf with vector text over one embedded background")
+    add_pool_arguments(cards)
+
+    printed = commands.add_parser("print-card", help="Render one card at print resolution to PNG, TIFF or PDF")
+    printed.add_argument("out", help="Output file; .png, .tif/.tiff or .pdf")
+    printed.add_argument("--type", choices=["invitation", "wishes"], required=True)
+    printed.add_argument("--card", help="JSON file with the card fields")
+    printed.add_argument("--set", action="append", default=[], metavar="FIELD=VALUE", help="Set a card field (repeatable)")
+    printed.add_argument("--paper", choices=list(app.PRINT_PAPER_SIZES), default="A5")
+    printed.add_argument("--dpi", type=int, default=app.PRINT_DPI)
+    printed.add_argument("--supersample", type=int, default=app.PRINT_SUPERSAMPLE, help="Anti-aliasing factor (1 disables it)")
+
+    parity = commands.add_parser("emotion-parity", help="Compare emotion backends against the default pipeline")
+    parity.add_argument("--backend", action="append", choices=app.EMOTION_BACKENDS, help="Backend to check (repeatable, default: all)")
+    parity.add_argument("--texts", help="Text file with one message per line (default: built-in samples)")
+    parity.add_argument("--min-agreement", type=float, default=0.9, help="Fail if a backend agrees on fewer labels than this")
+
+    assets = commands.add_parser("assets", help="Build the asset pack from an images folder")
+    assets.add_argument("images_dir", nargs="?", default=os.path.join(app.APP_DIR, "Images"))
+    assets.add_argument("--out", default=app.ASSET_PACK, help="Pack file to write; the index goes next to it as <out>.json")
+
+    export = commands.add_parser("emotion-export", help="Save the emotion model for offline use with EMOTION_MODEL_DIR")
+    export.add_argument("out_dir")
+    export.add_argument("--onnx", action="store_true", help="Also export model.onnx for EMOTION_BACKEND=onnx")
+    return parser
+
+def run_comic(args):
+    if not args.out_dir and not args.pdf:
+        print("error: nothing to do, pass --out-dir and/or --pdf", file=sys.stderr)
+        return 2
+    if args.vector_text and (args.out_dir or not args.pdf):
+        print("error: --vector-text only writes the PDF, pass --pdf without --out-dir", file=sys.stderr)
+        return 2
+
+    # Transcript -> emotions -> pages -> files is streamed, so memory stays flat for any transcript length
+    entries = app.iter_transcript(args.transcript, args.format)
+    stats = {'skipped': 0}
+    messages = app.iter_speakers(entries, args.speaker_a, args.speaker_b, stats)
+    user_genders = {'User A': args.gender_a, 'User B': args.gender_b}
+    def progress(message_count, page_count):
+        if page_count % 50 == 0:
+            print(f"{page_count} pages rendered ({message_count} messages read)", file=sys.stderr)
+    if args.vector_text:
+        with open(args.pdf, 'wb') as pdf_file:
+            counts = app.stream_comic_vector(messages, user_genders, pdf_file, use_model=not args.no_emotion, progress=progress)
+    else:
+        with app.create_render_executor(args.executor, args.workers) as executor, \
+                open(args.pdf, 'wb') if args.pdf else contextlib.nullcontext() as pdf_file:
+            counts = app.stream_comic(messages, user_genders, pdf_output=pdf_file, out_dir=args.out_dir,
+                                      encoding=args.pdf_encoding, quality=args.pdf_quality,
+                                      use_model=not args.no_emotion, executor=executor, progress=progress)
+    if stats['skipped']:
+        print(f"warning: skipped {stats['skipped']} messages from speakers other than User A/User B", file=sys.stderr)
+    for message in app.get_emotion_errors().values():
+        print(f"warning: {message}", file=sys.stderr)
+    if not counts['messages']:
+        if args.pdf:
+            os.remove(args.pdf)
+        print("error: no messages found in transcript", file=sys.stderr)
+        return 1
+    print(f"Rendered {counts['messages']} messages into {counts['pages']} pages")
+    return 0
+
+def load_card_data(args):
+    card_data = {}
+    if args.card:
+        with open(args.card, encoding='utf-8') as f:
+            card_data.update(json.load(f))
+    for item in args.set:
+        field, _, value = item.partition("=")
+        card_data[field.strip()] = value
+    return card_data
+
+def run_cards(args):
+    card_data = load_card_data(args)
+    writers = {'.zip': app.write_cards_zip, '.pdf': app.write_cards_pdf}
+    writer = writers.get(os.path.splitext(args.out)[1].lower())
+    if writer is None:
+        print("error: --out must end in .zip or .pdf", file=sys.stderr)
+        return 2
+    if args.vector_text and writer is not app.write_cards_pdf:
+        print("error: --vector-text needs a .pdf --out", file=sys.stderr)
+        return 2
+
+    if args.vector_text:
+        with open(args.guest_list, encoding='utf-8-sig', newline='') as guests, open(args.out, 'wb') as output:
+            count = app.write_cards_pdf_vector(args.type, card_data, app.iter_recipients(guests, args.type), output)
+        print(f"Rendered {count} cards into {args.out}")
+        return 0 if count else 1
+
+    with open(args.guest_list, encoding='utf-8-sig', newline='') as guests, \
+            app.create_render_executor(args.executor, args.workers) as executor, \
+            open(args.out, 'wb') as output:
+        cards = app.iter_bulk_cards(args.type, card_data, app.iter_recipients(guests, args.type), executor=executor)
+        count = writer(cards, output)
+    print(f"Rendered {count} cards into {args.out}")
+    return 0 if count else 1
+
+PRINT_EXTENSIONS = {'.png': 'png', '.tif': 'tiff', '.tiff': 'tiff', '.pdf': 'pdf'}
+
+def run_print_card(args):
+    fmt = PRINT_EXTENSIONS.get(os.path.splitext(args.out)[1].lower())
+    if fmt is None:
+        print("error: output must end in .png, .tif, .tiff or .pdf", file=sys.stderr)
+        return 2
+    with open(args.out, 'wb') as output:
+        width, height = app.render_print_card(args.type, load_card_data(args), output, fmt, args.paper,
+                                              args.dpi, args.supersample)
+    print(f"Rendered a {width}x{height} {args.paper} card at {args.dpi} dpi into {args.out}")
+    return 0
+
+def run_emotion_parity(args):
+    texts = None
+    if args.texts:
+        with open(args.texts, encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+    results = app.compare_emotion_backends(args.backend or app.EMOTION_BACKENDS, texts)
+    failed = False
+    for backend, result in results.items():
+        print(f"{backend:<10} agreement {result['agreement']:6.1%}  {result['ms_per_text']:8.2f} ms/text  load {result['load_s']:6.1f} s")
+        for text, expected, label in result['mismatches']:
+            print(f"    {expected} -> {label}: {text[:60]}")
+        failed = failed or result['agreement'] < args.min_agreement
+    return 1 if failed else 0
+
+def run_assets(args):
+    if not os.path.isdir(args.images_dir):
+        print(f"error: {args.images_dir} is not a directory", file=sys.stderr)
+        return 2
+    index = app.build_asset_pack(args.images_dir, args.out)
+    for key, entry in sorted(index['characters'].items()):
+        width, height = entry['size']
+        print(f"{key:<18} {width:>4}x{height:<4} {entry['source']}")
+    for i, entry in enumerate(index['backgrounds']):
+        print(f"{'background ' + str(i + 1):<18} {entry['size'][0]:>4}x{entry['size'][1]:<4} {entry['source']}")
+    for source in index['skipped']:
+        print(f"skipped: {source} (no gender/emotion in the name, or a duplicate)", file=sys.stderr)
+    print(f"Wrote {len(index['characters'])} characters and {len(index['backgrounds'])} backgrounds to {args.out}")
+    return 0 if index['characters'] or index['backgrounds'] else 1
+
+def run_emotion_export(args):
+    app.export_emotion_model(args.out_dir, onnx=args.onnx)
+    print(f"Saved {app.EMOTION_MODEL} to {args.out_dir}")
+    return 0
+
+def write_metrics(path):
+    # Only this process is covered; use --executor thread to include page and card rendering
+    metrics = app.get_metrics()
+    with open(path, 'w', encoding='utf-8') as f:
+        if path.endswith(".json"):
+            json.dump(metrics.snapshot(), f, indent=2)
+        else:
+            f.write(metrics.prometheus_text())
+
+def run(argv=None):
+    args = build_parser().parse_args(argv)
+    commands = {'comic': run_comic, 'cards': run_cards, 'print-card': run_print_card,
+                'emotion-parity': run_emotion_parity, 'emotion-export': run_emotion_export, 'assets': run_assets}
+    try:
+        return commands[args.command](args)
+    finally:
+        if args.metrics:
+            write_metrics(args.metrics)
+
+if __name__ == "__main__":
+    # The render paths use process_cache rather than st.cache_resource, whose spinner printed the
+    # "streamlit run" banner; st.warning/st.error on error paths still log "missing ScriptRunContext"
+    st_logger.set_log_level("error")
+    sys.exit(run())
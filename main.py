@@ -1,47 +1,97 @@
 import streamlit as st
 import io
-import base64
+import csv
+import hashlib
+import importlib
+import itertools
+import json
+import mmap
+import multiprocessing
 import os
-import textwrap
+import re
+import sys
 import tempfile
+import uuid
+import zipfile
+import zlib
+import queue
 import random
+import shutil
+import struct
+import threading
+import time
+import weakref
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+from functools import wraps
+from concurrent.futures import Future, ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError as FuturesTimeout
 from datetime import datetime
-from PIL import Image, ImageDraw, ImageFont, ImageFilter, ImageEnhance
-from transformers import pipeline
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter, A4
-from reportlab.lib.utils import ImageReader
+import numpy as np
+from PIL import Image, ImageColor, ImageDraw, ImageFont, ImageFilter, ImageEnhance
+
+# Heavy dependencies are imported where they are used: transformers/torch in
+# load_emotion_detector, ReportLab in create_comic_pdf
+_SCRIPT_STARTED = time.perf_counter()
 
 # ==========================================
 # 1. PAGE CONFIGURATION
 # ==========================================
-st.set_page_config(
-    page_title="Creative AI Studio",
-    page_icon="🎨",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+# Called from main() so the helpers below can be imported without a Streamlit runtime (see cli.py)
+def configure_page():
+    st.set_page_config(
+        page_title="Creative AI Studio",
+        page_icon="🎨",
+        layout="wide",
+        initial_sidebar_state="expanded"
+    )
 
 # ==========================================
 # 2. SESSION STATE INITIALIZATION (COMBINED)
 # ==========================================
-# Chat2Comic State
-if 'messages' not in st.session_state:
-    st.session_state.messages = []
-if 'comic_pages' not in st.session_state:
-    st.session_state.comic_pages = []
-if 'user_genders' not in st.session_state:
-    st.session_state.user_genders = {'User A': 'male', 'User B': 'female'}
-
-# Card Generator State
-if 'current_step' not in st.session_state:
-    st.session_state.current_step = 'start'
-if 'card_type' not in st.session_state:
-    st.session_state.card_type = None
-if 'card_data' not in st.session_state:
-    st.session_state.card_data = {}
-if 'generated_card' not in st.session_state:
-    st.session_state.generated_card = None
+def init_session_state():
+    # Chat2Comic State; the conversation id in the URL lets a reload restore the chat from disk
+    if 'conversation_id' not in st.session_state:
+        conversation_id = _get_query_param('c')
+        saved = load_conversation(conversation_id)
+        if saved:
+            st.session_state.messages, st.session_state.user_genders = saved
+        else:
+            conversation_id = uuid.uuid4().hex[:16]
+        st.session_state.conversation_id = conversation_id
+        if SAVE_CONVERSATIONS:
+            _set_query_param('c', conversation_id)
+    if 'messages' not in st.session_state:
+        st.session_state.messages = []
+    if 'comic_pages' not in st.session_state:
+        st.session_state.comic_pages = new_page_store()
+    if 'user_genders' not in st.session_state:
+        st.session_state.user_genders = {'User A': 'male', 'User B': 'female'}
+    if 'rendered_genders' not in st.session_state:
+        st.session_state.rendered_genders = dict(st.session_state.user_genders)
+    if 'zoomed_page' not in st.session_state:
+        st.session_state.zoomed_page = None
+    if 'pdf_job' not in st.session_state:
+        st.session_state.pdf_job = None
+    # message index -> (future, text) for emotions still being detected; page number -> RenderJob;
+    # page number -> send time for pages waiting on their emotions, and for pages not shown yet
+    if 'pending_emotions' not in st.session_state:
+        st.session_state.pending_emotions = {}
+    if 'pending_pages' not in st.session_state:
+        st.session_state.pending_pages = {}
+    if 'deferred_pages' not in st.session_state:
+        st.session_state.deferred_pages = {}
+    if 'page_sent_at' not in st.session_state:
+        st.session_state.page_sent_at = {}
+
+    # Card Generator State
+    if 'current_step' not in st.session_state:
+        st.session_state.current_step = 'start'
+    if 'card_type' not in st.session_state:
+        st.session_state.card_type = None
+    if 'card_data' not in st.session_state:
+        st.session_state.card_data = {}
+    if 'generated_card' not in st.session_state:
+        st.session_state.generated_card = None
 
 # ==========================================
 # 3. GLOBAL CONFIG FOR COMIC APP
@@ -77,36 +127,727 @@ BACKGROUND_IMAGES = [
     "C:\\Users\\vinay\\chat2comic\\Images\\Background\\bg-3.jpg",
 ]
 
+PAGE_SIZE = (800, 600)
+CHARACTER_MAX_SIZE = 250
+
+# Pre-trimmed, pre-scaled characters and pre-sized backgrounds built by `cli.py assets` (index next to
+# it as <pack>.json). When the pack exists it is used before the paths above; empty disables it
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+ASSET_PACK = os.environ.get("ASSET_PACK", os.path.join(APP_DIR, "assets.pack"))
+ASSET_PACK_VERSION = 1
+
+# Decoded images shared by all sessions; files are re-checked for changes at most once per interval
+ASSET_CACHE_BUDGET_MB = int(os.environ.get("ASSET_CACHE_BUDGET_MB", "64"))
+ASSET_CACHE_CHECK_INTERVAL = float(os.environ.get("ASSET_CACHE_CHECK_INTERVAL", "2.0"))
+
+# Multi-page renders ("process" or "thread" pool); 0 workers means one per CPU
+RENDER_EXECUTOR = os.environ.get("RENDER_EXECUTOR", "process")
+RENDER_WORKERS = int(os.environ.get("RENDER_WORKERS", "0")) or (os.cpu_count() or 1)
+
+# Render service: RENDER_SERVICE_JOBS PDF exports run at once (pages and cards go straight to the
+# render pool), at most RENDER_QUEUE_SIZE jobs are queued or running, each limited to RENDER_JOB_TIMEOUT seconds
+RENDER_SERVICE_JOBS = int(os.environ.get("RENDER_SERVICE_JOBS", "2"))
+RENDER_QUEUE_SIZE = int(os.environ.get("RENDER_QUEUE_SIZE", "32"))
+RENDER_JOB_TIMEOUT = float(os.environ.get("RENDER_JOB_TIMEOUT", "120"))
+RENDER_JOB_HISTORY = 16
+RENDER_POLL_INTERVAL = 0.5
+
+# Rendered pages on disk, keyed by a hash of everything that affects the page; 0 MB disables it
+RENDERER_VERSION = 1
+RENDER_CACHE_DIR = os.environ.get("RENDER_CACHE_DIR", os.path.join(os.path.expanduser("~"), ".cache", "chat2comic"))
+RENDER_CACHE_MAX_MB = int(os.environ.get("RENDER_CACHE_MAX_MB", "256"))
+RENDER_CACHE_SCAN_INTERVAL = float(os.environ.get("RENDER_CACHE_SCAN_INTERVAL", "30"))
+# Conversations are saved as plain text under the random id in the URL (?c=...), so anyone who has the
+# link, or can read RENDER_CACHE_DIR, can read the chat; 0 turns saving and restoring off
+SAVE_CONVERSATIONS = os.environ.get("SAVE_CONVERSATIONS", "1") != "0"
+# Saved conversations are deleted after this many days without a new message; 0 keeps them
+CONVERSATION_MAX_DAYS = float(os.environ.get("CONVERSATION_MAX_DAYS", "30"))
+CONVERSATION_PRUNE_INTERVAL = 3600
+
+# Comic pages of each session are kept PNG-encoded; pages over the per-session or process-wide
+# budget are spilled to disk, and only the last few pages read stay decoded
+PAGE_STORE_SESSION_MB = float(os.environ.get("PAGE_STORE_SESSION_MB", "16"))
+PAGE_STORE_GLOBAL_MB = float(os.environ.get("PAGE_STORE_GLOBAL_MB", "256"))
+PAGE_STORE_HOT_PAGES = int(os.environ.get("PAGE_STORE_HOT_PAGES", "2"))
+PAGE_STORE_DIR = os.environ.get("PAGE_STORE_DIR", os.path.join(RENDER_CACHE_DIR, "sessions"))
+
+# The comic gallery shows this many downscaled pages at a time; full-size pages are sent on request
+GALLERY_PAGE_SIZE = int(os.environ.get("GALLERY_PAGE_SIZE", "6"))
+COMIC_THUMBNAIL_WIDTH = 360
+PAGE_STORE_THUMBNAILS = 64
+
+EMOTION_MODEL = os.environ.get("EMOTION_MODEL", "j-hartmann/emotion-english-distilroberta-base")
+EMOTION_BATCH_SIZE = int(os.environ.get("EMOTION_BATCH_SIZE", "16"))
+EMOTION_CACHE_SIZE = int(os.environ.get("EMOTION_CACHE_SIZE", "4096"))
+# Requests from all sessions are batched: a batch runs when it is full or this long after its first request
+EMOTION_BATCH_WAIT_MS = float(os.environ.get("EMOTION_BATCH_WAIT_MS", "10"))
+EMOTION_LABELS = ("joy", "sadness", "anger", "fear", "surprise", "disgust", "neutral")
+# Shown until background detection returns the real emotion. A page waits up to this long for its
+# emotions before it is drawn with the provisional one (and redrawn when they arrive)
+PROVISIONAL_EMOTION = "neutral"
+PROVISIONAL_RENDER_AFTER_MS = float(os.environ.get("PROVISIONAL_RENDER_AFTER_MS", "300"))
+
+# CPU inference: "pipeline" (fp32), "quantized" (dynamic int8 torch) or "onnx" (onnxruntime via optimum).
+# EMOTION_MODEL_DIR loads from a local directory only (see `cli.py emotion-export`); 0 threads keeps the runtime default
+EMOTION_BACKENDS = ('pipeline', 'quantized', 'onnx')
+EMOTION_BACKEND = os.environ.get("EMOTION_BACKEND", "pipeline")
+EMOTION_MODEL_DIR = os.environ.get("EMOTION_MODEL_DIR", "")
+EMOTION_THREADS = int(os.environ.get("EMOTION_THREADS", "0"))
+EMOTION_MAX_LENGTH = int(os.environ.get("EMOTION_MAX_LENGTH", "128"))
+
+# Print-size cards are drawn in bands of PRINT_BAND_ROWS output rows at PRINT_SUPERSAMPLE x the
+# resolution, then averaged down; paper sizes are portrait (width, height) in millimetres
+PRINT_DPI = int(os.environ.get("PRINT_DPI", "300"))
+PRINT_SUPERSAMPLE = int(os.environ.get("PRINT_SUPERSAMPLE", "2"))
+PRINT_BAND_ROWS = int(os.environ.get("PRINT_BAND_ROWS", "256"))
+PRINT_PAPER_SIZES = {'A5': (148.0, 210.0), 'A6': (105.0, 148.0), 'postcard': (101.6, 152.4)}
+PRINT_FORMATS = ('png', 'tiff', 'pdf')
+
+# Per-stage timings; METRICS_LOG appends one JSON line per span to this file ("-" for stderr)
+METRICS_LOG = os.environ.get("METRICS_LOG", "")
+METRICS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Font files tried in order; FONT_PATHS (os.pathsep separated) is searched before the built-in chain
+FONT_DIR = os.path.join(APP_DIR, "fonts")
+FONT_FAMILIES = {
+    'regular': [
+        os.path.join(FONT_DIR, "DejaVuSans.ttf"),
+        "arial.ttf",
+        "C:\\Windows\\Fonts\\arial.ttf",
+        "/Library/Fonts/Arial.ttf",
+        "/System/Library/Fonts/Supplemental/Arial.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Regular.ttf",
+        "DejaVuSans.ttf",
+    ],
+    'bold': [
+        os.path.join(FONT_DIR, "DejaVuSans-Bold.ttf"),
+        "arialbd.ttf",
+        "C:\\Windows\\Fonts\\arialbd.ttf",
+        "/Library/Fonts/Arial Bold.ttf",
+        "/System/Library/Fonts/Supplemental/Arial Bold.ttf",
+        "/usr/share/fonts/truetype/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/dejavu/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/TTF/DejaVuSans-Bold.ttf",
+        "/usr/share/fonts/truetype/liberation/LiberationSans-Bold.ttf",
+        "DejaVuSans-Bold.ttf",
+    ],
+}
+FONT_PATHS = [path for path in os.environ.get("FONT_PATHS", "").split(os.pathsep) if path]
+
 # ==========================================
-# 4. HELPER FUNCTIONS: CHAT2COMIC
+# 4. SHARED HELPERS: FONTS & TEXT LAYOUT
 # ==========================================
 
-@st.cache_resource
+# Process-wide memoization for code that also runs off the script thread (the emotion batcher, render
+# threads, pool workers, the CLI and bench), where st.cache_resource does not cache. Under `streamlit run`
+# this file re-executes as __main__ on every rerun, so entries live in the importable module's registry
+_PROCESS_CACHES = {}
+_PROCESS_CACHES_LOCK = threading.Lock()
+
+def _process_cache_entry(name):
+    home = _renderer_module()
+    with home._PROCESS_CACHES_LOCK:
+        return home._PROCESS_CACHES.setdefault(name, (threading.RLock(), OrderedDict()))
+
+def process_cache(func=None, *, max_entries=None):
+    def decorator(func):
+        name = func.__qualname__
+        state = None
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            nonlocal state
+            lock, entries = state = state or _process_cache_entry(name)
+            key = (args, tuple(sorted(kwargs.items()))) if kwargs else args
+            # Held while computing, so a model or pool is built once even when threads race for it
+            with lock:
+                if key in entries:
+                    entries.move_to_end(key)
+                    return entries[key]
+                value = entries[key] = func(*args, **kwargs)
+                if max_entries and len(entries) > max_entries:
+                    entries.popitem(last=False)
+                return value
+
+        def clear():
+            lock, entries = _process_cache_entry(name)
+            with lock:
+                entries.clear()
+
+        wrapper.clear = clear
+        return wrapper
+    return decorator(func) if func else decorator
+
+@process_cache
+def resolve_font_path(family='regular'):
+    candidates = FONT_PATHS + FONT_FAMILIES.get(family, FONT_FAMILIES['regular'])
+    for path in candidates:
+        try:
+            # Pillow may find the file by name in system font dirs; keep the path it actually opened
+            return ImageFont.truetype(path, 12).path
+        except OSError:
+            continue
+    return None
+
+@process_cache
+def get_font(size, family='regular'):
+    path = resolve_font_path(family)
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+TEXT_MEASURE_CACHE_SIZE = 50000
+
+class TextLayout:
+    def __init__(self, lines, widths, font, line_height):
+        self.lines = lines
+        self.widths = widths
+        self.font = font
+        self.line_height = line_height
+        self.width = int(max(widths, default=0))
+        self.height = len(lines) * line_height
+
+    def draw(self, draw, x, y, fill, box_width=None, align='center'):
+        # Consumes the measured widths; nothing is re-measured while drawing
+        box_width = self.width if box_width is None else box_width
+        for line, line_width in zip(self.lines, self.widths):
+            if align == 'center':
+                line_x = x + (box_width - line_width) // 2
+            elif align == 'right':
+                line_x = x + box_width - line_width
+            else:
+                line_x = x
+            draw.text((int(line_x), y), line, fill=fill, font=self.font)
+            y += self.line_height
+        return y
+
+@process_cache
+def get_text_measure_cache():
+    return {}
+
+def _font_key(font):
+    return (getattr(font, 'path', None) or id(font), getattr(font, 'size', None))
+
+def measure_text(font, text, memo=None):
+    memo = get_text_measure_cache() if memo is None else memo
+    key = (_font_key(font), text)
+    width = memo.get(key)
+    if width is None:
+        if len(memo) >= TEXT_MEASURE_CACHE_SIZE:
+            memo.clear()
+        width = memo[key] = font.getlength(text)
+    return width
+
+def _break_word(word, font, max_width, memo):
+    pieces, current = [], ''
+    for char in word:
+        if current and measure_text(font, current + char, memo) > max_width:
+            pieces.append(current)
+            current = char
+        else:
+            current += char
+    return pieces + [current]
+
+def wrap_text(text, font, max_width, memo=None):
+    # Greedy wrap by rendered width; explicit newlines are kept and over-long words are split
+    memo = get_text_measure_cache() if memo is None else memo
+    space = measure_text(font, ' ', memo)
+    lines = []
+    for paragraph in text.split('\n'):
+        current, current_width = '', 0
+        for word in paragraph.split():
+            word_width = measure_text(font, word, memo)
+            if word_width > max_width:
+                if current:
+                    lines.append(current)
+                *full, current = _break_word(word, font, max_width, memo)
+                lines.extend(full)
+                current_width = measure_text(font, current, memo)
+            elif current and current_width + space + word_width <= max_width:
+                current += ' ' + word
+                current_width += space + word_width
+            elif current:
+                lines.append(current)
+                current, current_width = word, word_width
+            else:
+                current, current_width = word, word_width
+        lines.append(current)
+    return lines
+
+def layout_text(text, font_size, max_width, line_height, max_height=None, min_font_size=None, max_lines=None, family='regular'):
+    # Shrinks the font until the text fits max_height (down to min_font_size), then truncates with an ellipsis
+    memo = get_text_measure_cache()
+    size = font_size
+    while True:
+        font = get_font(size, family)
+        scaled_line_height = max(1, round(line_height * size / font_size))
+        lines = wrap_text(text, font, max_width, memo)
+        fits = max_height is None or len(lines) * scaled_line_height <= max_height
+        if fits or min_font_size is None or size <= min_font_size:
+            break
+        size -= 1
+    limit = max_lines
+    if max_height is not None:
+        limit = min(limit or len(lines), max(1, max_height // scaled_line_height))
+    if limit is not None and len(lines) > limit:
+        lines = lines[:limit]
+        last = lines[-1]
+        while last and measure_text(font, last + '…', memo) > max_width:
+            last = last[:-1]
+        lines[-1] = last.rstrip() + '…'
+    widths = [measure_text(font, line, memo) for line in lines]
+    return TextLayout(lines, widths, font, scaled_line_height)
+
+def fit_text_line(text, font_size, max_width, min_font_size, family='regular'):
+    # Single line (titles): largest size down to min_font_size whose width fits max_width,
+    # truncated with an ellipsis if even min_font_size is too wide
+    for size in range(font_size, min_font_size - 1, -1):
+        font = get_font(size, family)
+        width = measure_text(font, text)
+        if width <= max_width:
+            return TextLayout([text], [width], font, size)
+    while text and width > max_width:
+        text = text[:-1]
+        width = measure_text(font, text.rstrip() + '…')
+    text = text.rstrip() + '…'
+    return TextLayout([text], [width], font, size)
+
+# ==========================================
+# 5. HELPER FUNCTIONS: CHAT2COMIC
+# ==========================================
+
+@process_cache
+def get_startup_metrics():
+    return {}
+
+def record_startup_metric(name, seconds, first_only=True):
+    metrics = get_startup_metrics()
+    if first_only:
+        metrics.setdefault(name, seconds)
+    else:
+        metrics[name] = seconds
+
+class Metrics:
+    # Counters and fixed-bucket latency histograms, aggregated per process (render pool workers keep their own)
+    def __init__(self, buckets=METRICS_BUCKETS, log_path=METRICS_LOG):
+        self.buckets = buckets
+        self.log_path = log_path
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.histograms = {}
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def observe(self, stage, seconds, ok=True):
+        with self.lock:
+            hist = self.histograms.get(stage)
+            if hist is None:
+                hist = self.histograms[stage] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0, 'max': 0.0, 'errors': 0}
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    hist['buckets'][i] += 1
+                    break
+            hist['count'] += 1
+            hist['sum'] += seconds
+            hist['max'] = max(hist['max'], seconds)
+            if not ok:
+                hist['errors'] += 1
+            if self.log_path:
+                self._log({'ts': time.time(), 'stage': stage, 'ms': round(seconds * 1000, 3), 'ok': ok, 'pid': os.getpid()})
+
+    def _log(self, record):
+        line = json.dumps(record) + "\n"
+        try:
+            if self.log_path == "-":
+                sys.stderr.write(line)
+            else:
+                with open(self.log_path, 'a', encoding='utf-8') as f:
+                    f.write(line)
+        except OSError:
+            pass
+
+    def quantile(self, stage, q):
+        # Upper bound of the bucket holding the q-th observation
+        hist = self.histograms.get(stage)
+        if not hist or not hist['count']:
+            return None
+        rank, seen = q * hist['count'], 0
+        for bound, n in zip(self.buckets, hist['buckets']):
+            seen += n
+            if seen >= rank:
+                return bound
+        return hist['max']
+
+    def snapshot(self):
+        with self.lock:
+            stages = {}
+            for stage, hist in self.histograms.items():
+                stages[stage] = {'count': hist['count'], 'errors': hist['errors'], 'total_s': hist['sum'],
+                                 'mean_ms': hist['sum'] * 1000 / hist['count'], 'max_ms': hist['max'] * 1000,
+                                 'p50_ms': self.quantile(stage, 0.5) * 1000, 'p95_ms': self.quantile(stage, 0.95) * 1000}
+            return {'pid': os.getpid(), 'counters': dict(self.counters), 'stages': stages}
+
+    def prometheus_text(self, prefix="chat2comic"):
+        lines = []
+        with self.lock:
+            lines.append(f"# HELP {prefix}_stage_seconds Time spent per pipeline stage.")
+            lines.append(f"# TYPE {prefix}_stage_seconds histogram")
+            for stage, hist in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(self.buckets, hist['buckets']):
+                    cumulative += n
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="+Inf"}} {hist["count"]}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {hist["sum"]:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {hist["count"]}')
+            lines.append(f"# HELP {prefix}_stage_errors_total Spans that raised an exception.")
+            lines.append(f"# TYPE {prefix}_stage_errors_total counter")
+            for stage, hist in sorted(self.histograms.items()):
+                lines.append(f'{prefix}_stage_errors_total{{stage="{stage}"}} {hist["errors"]}')
+            lines.append(f"# HELP {prefix}_events_total Cache hits, misses and other events.")
+            lines.append(f"# TYPE {prefix}_events_total counter")
+            for name, value in sorted(self.counters.items()):
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def reset(self):
+        with self.lock:
+            self.counters.clear()
+            self.histograms.clear()
+
+@process_cache
+def get_metrics():
+    return Metrics()
+
+@contextmanager
+def timed(stage):
+    started = time.perf_counter()
+    ok = False
+    try:
+        yield
+        ok = True
+    finally:
+        get_metrics().observe(stage, time.perf_counter() - started, ok)
+
+def instrumented(stage=None):
+    def decorator(func):
+        name = stage or func.__name__
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with timed(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def count_event(name, value=1):
+    get_metrics().count(name, value)
+
+def emotion_model_source():
+    # A configured model directory is loaded without touching the network
+    if EMOTION_MODEL_DIR:
+        return EMOTION_MODEL_DIR, True
+    return EMOTION_MODEL, False
+
+def build_emotion_detector(backend=EMOTION_BACKEND, threads=EMOTION_THREADS):
+    if backend not in EMOTION_BACKENDS:
+        raise ValueError(f"Unknown emotion backend '{backend}', expected one of: {', '.join(EMOTION_BACKENDS)}")
+    from transformers import AutoTokenizer, pipeline
+    source, local_only = emotion_model_source()
+    tokenizer = AutoTokenizer.from_pretrained(source, local_files_only=local_only)
+    if backend == 'onnx':
+        from onnxruntime import SessionOptions
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        options = SessionOptions()
+        if threads:
+            options.intra_op_num_threads = threads
+        exported = os.path.exists(os.path.join(source, "model.onnx"))
+        model = ORTModelForSequenceClassification.from_pretrained(
+            source, export=not exported, local_files_only=local_only,
+            session_options=options, provider="CPUExecutionProvider")
+    else:
+        import torch
+        from transformers import AutoModelForSequenceClassification
+        if threads:
+            torch.set_num_threads(threads)
+        model = AutoModelForSequenceClassification.from_pretrained(source, local_files_only=local_only).eval()
+        if backend == 'quantized':
+            # int8 weights for every Linear layer, activations are quantized on the fly
+            model = torch.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+    return pipeline("text-classification", model=model, tokenizer=tokenizer)
+
+def export_emotion_model(directory, onnx=False):
+    # Saves tokenizer and weights (plus model.onnx) so EMOTION_MODEL_DIR works offline
+    from transformers import AutoModelForSequenceClassification, AutoTokenizer
+    AutoTokenizer.from_pretrained(EMOTION_MODEL).save_pretrained(directory)
+    AutoModelForSequenceClassification.from_pretrained(EMOTION_MODEL).save_pretrained(directory)
+    if onnx:
+        from optimum.onnxruntime import ORTModelForSequenceClassification
+        ORTModelForSequenceClassification.from_pretrained(EMOTION_MODEL, export=True).save_pretrained(directory)
+
+@process_cache
+def get_emotion_errors():
+    # The model loads on the warm-up thread and runs on the batcher thread, where st.warning has no
+    # script to show in; problems are kept here (latest per kind) and shown by the sidebar instead
+    return {}
+
+def report_emotion_error(kind, message):
+    get_emotion_errors()[kind] = message
+
+@process_cache
 def load_emotion_detector():
+    started = time.perf_counter()
     try:
-        return pipeline("text-classification", model="j-hartmann/emotion-english-distilroberta-base")
+        try:
+            return build_emotion_detector(EMOTION_BACKEND)
+        except ImportError as e:
+            if EMOTION_BACKEND == 'pipeline':
+                raise
+            report_emotion_error('backend', f"Emotion backend '{EMOTION_BACKEND}' is not available ({e}), using the default pipeline")
+            return build_emotion_detector('pipeline')
     except Exception as e:
-        st.warning(f"Could not load emotion detection model: {e}")
+        # Cached like a model, so it is not retried until the process restarts
+        report_emotion_error('load', f"Could not load emotion detection model, messages are labelled neutral: {e}")
         return None
+    finally:
+        record_startup_metric('model_load_s', time.perf_counter() - started)
 
-def detect_emotion(text):
+@process_cache
+def warm_emotion_detector():
+    # Loads the model on a daemon thread so the first message does not wait for the download
+    thread = threading.Thread(target=load_emotion_detector, name="emotion-warmup", daemon=True)
+    thread.start()
+    return thread
+
+_emotion_detector_override = None
+
+@process_cache
+def get_emotion_memo():
+    return OrderedDict(), threading.Lock()
+
+def set_emotion_detector(detector):
+    # Swap in any callable with the pipeline's call signature, e.g. a small local model; None restores the default
+    global _emotion_detector_override
+    _emotion_detector_override = detector
+    clear_emotion_cache()
+
+def clear_emotion_cache():
+    memo, lock = get_emotion_memo()
+    with lock:
+        memo.clear()
+
+def _normalize_emotion_text(text):
+    return ' '.join(text.split())
+
+def _emotion_key(normalized):
+    return hashlib.sha1(normalized.encode('utf-8')).hexdigest()
+
+def _classify_emotions(texts, batch_size, emotion_detector=None):
+    emotion_detector = emotion_detector or _emotion_detector_override or load_emotion_detector()
+    if not emotion_detector:
+        return None
+    results = emotion_detector(texts, batch_size=batch_size, padding=True, truncation=True, max_length=EMOTION_MAX_LENGTH)
+    labels = []
+    for result in results:
+        if isinstance(result, list):
+            result = result[0]
+        labels.append(result['label'].lower())
+    return labels
+
+@instrumented()
+def detect_emotions(texts, batch_size=None, emotion_detector=None, memo=None):
+    batch_size = batch_size or EMOTION_BATCH_SIZE
+    emotions = [None] * len(texts)
+    pending = OrderedDict()
+    memo, lock = memo or get_emotion_memo()
+    with lock:
+        for i, text in enumerate(texts):
+            normalized = _normalize_emotion_text(text)
+            key = _emotion_key(normalized)
+            if key in memo:
+                memo.move_to_end(key)
+                emotions[i] = memo[key]
+            else:
+                pending.setdefault(key, (normalized, []))[1].append(i)
+    count_event('emotion_cache_hit', len(texts) - sum(len(indices) for _, indices in pending.values()))
+    if not pending:
+        return emotions
+    count_event('emotion_cache_miss', len(pending))
+
+    started = time.perf_counter()
     try:
-        emotion_detector = load_emotion_detector()
-        if emotion_detector:
-            results = emotion_detector(text)
-            return results[0]['label'].lower()
-        else:
-            return "neutral"
+        with timed('emotion_inference'):
+            labels = _classify_emotions([normalized for normalized, _ in pending.values()], batch_size, emotion_detector)
+        get_emotion_errors().pop('inference', None)
     except Exception as e:
-        st.warning(f"Emotion detection failed: {e}")
-        return "neutral"
+        report_emotion_error('inference', f"Emotion detection failed: {e}")
+        labels = None
+    record_startup_metric('first_emotion_s', time.perf_counter() - started)
+
+    with lock:
+        for n, (key, (_, indices)) in enumerate(pending.items()):
+            emotion = labels[n] if labels else "neutral"
+            for i in indices:
+                emotions[i] = emotion
+            # Only real predictions are memoized, so texts that fell back to neutral after an inference
+            # error (or while no model was loaded) are classified again next time
+            if labels:
+                memo[key] = emotion
+                memo.move_to_end(key)
+        while len(memo) > EMOTION_CACHE_SIZE:
+            memo.popitem(last=False)
+    return emotions
+
+def cached_emotion(text, memo=None):
+    memo, lock = memo or get_emotion_memo()
+    key = _emotion_key(_normalize_emotion_text(text))
+    with lock:
+        return memo.get(key)
+
+class EmotionBatcher:
+    # One inference thread per process serves every session: queued texts are classified in
+    # micro-batches of up to max_batch, collected for at most max_wait seconds after the first arrives.
+    # The batcher holds the detector (loaded by the first batch unless given) and the memo for its lifetime
+    def __init__(self, max_batch=EMOTION_BATCH_SIZE, max_wait=EMOTION_BATCH_WAIT_MS / 1000, classify=None,
+                 emotion_detector=None, memo=None):
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.emotion_detector = emotion_detector
+        self.memo = memo or get_emotion_memo()
+        self.classify = classify or self._detect
+        self.batches = 0
+        self.texts = 0
+        self.largest_batch = 0
+        self.max_depth = 0
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._serve, name="emotion-batcher", daemon=True)
+        self._thread.start()
+
+    def submit(self, text):
+        future = Future()
+        emotion = cached_emotion(text, self.memo)
+        if emotion is not None:
+            count_event('emotion_cache_hit')
+            future.set_result(emotion)
+            return future
+        self._queue.put((text, future, time.perf_counter()))
+        with self._lock:
+            self.max_depth = max(self.max_depth, self._queue.qsize())
+        return future
+
+    def _serve(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._run(batch)
+
+    def _detect(self, texts):
+        # A detector swapped in with set_emotion_detector wins over the one held here
+        emotion_detector = _emotion_detector_override or self.emotion_detector
+        if emotion_detector is None:
+            emotion_detector = self.emotion_detector = load_emotion_detector()
+        return detect_emotions(texts, emotion_detector=emotion_detector, memo=self.memo)
+
+    def _run(self, batch):
+        started = time.perf_counter()
+        metrics = get_metrics()
+        for _, _, queued_at in batch:
+            metrics.observe('emotion_queue_wait', started - queued_at)
+        count_event('emotion_batches')
+        count_event('emotion_batched_texts', len(batch))
+        with self._lock:
+            self.batches += 1
+            self.texts += len(batch)
+            self.largest_batch = max(self.largest_batch, len(batch))
+        try:
+            labels = self.classify([text for text, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                future.set_exception(e)
+            return
+        for (_, future, _), label in zip(batch, labels):
+            future.set_result(label)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'depth': self._queue.qsize(), 'max_depth': self.max_depth, 'batches': self.batches,
+                'texts': self.texts, 'mean_batch': self.texts / self.batches if self.batches else 0.0,
+                'largest_batch': self.largest_batch, 'max_batch': self.max_batch, 'max_wait_ms': self.max_wait * 1000,
+            }
+
+@process_cache
+def get_emotion_batcher():
+    return EmotionBatcher()
+
+def detect_emotion(text):
+    # Shares a forward pass with whatever other sessions are classifying at the same moment
+    return get_emotion_batcher().submit(text).result()
+
+EMOTION_PARITY_TEXTS = [
+    "I can't believe we finally won the championship!",
+    "Thanks so much, this made my whole day.",
+    "I miss you so much, the house feels empty without you.",
+    "My grandfather passed away last night.",
+    "Why would you tell everyone my secret? I'm furious.",
+    "Stop interrupting me every single time I talk!",
+    "I heard a noise downstairs and I'm too scared to check.",
+    "What if I fail the exam tomorrow?",
+    "Wait, you're moving to Japan next week?!",
+    "No way, they actually showed up?",
+    "Ugh, there's mould all over the bread.",
+    "That joke was honestly disgusting.",
+    "The meeting is at 3 pm in room 204.",
+    "I'll pick up the groceries on my way home.",
+    "ok",
+    "Happy birthday! Hope this year brings you everything you wished for " * 8,
+]
+
+def compare_emotion_backends(backends, texts=None, reference='pipeline', batch_size=None):
+    # Labels from each backend are compared with the reference backend on the same texts
+    texts = texts or EMOTION_PARITY_TEXTS
+    batch_size = batch_size or EMOTION_BATCH_SIZE
+    results = {}
+    for backend in [reference] + [b for b in backends if b != reference]:
+        started = time.perf_counter()
+        detector = build_emotion_detector(backend)
+        load_s = time.perf_counter() - started
+        _classify_emotions(texts[:1], 1, detector)
+        started = time.perf_counter()
+        labels = _classify_emotions(texts, batch_size, detector)
+        elapsed = time.perf_counter() - started
+        results[backend] = {'labels': labels, 'load_s': load_s, 'ms_per_text': elapsed * 1000 / len(texts)}
+        del detector
+    expected = results[reference]['labels']
+    for result in results.values():
+        result['agreement'] = sum(a == b for a, b in zip(result['labels'], expected)) / len(expected)
+        result['mismatches'] = [(text, b, a) for text, a, b in zip(texts, result['labels'], expected) if a != b]
+    return results
 
 def load_local_image(image_path):
     try:
         if os.path.exists(image_path):
             image = Image.open(image_path)
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+            # Cut-out characters keep their transparency
+            if image.mode not in ('RGB', 'RGBA'):
+                has_alpha = 'A' in image.getbands() or 'transparency' in image.info
+                image = image.convert('RGBA' if has_alpha else 'RGB')
             return image
         else:
             return None
@@ -114,8 +855,220 @@ def load_local_image(image_path):
         st.error(f"Error loading image {image_path}: {e}")
         return None
 
+class AssetCache:
+    def __init__(self, budget_bytes, check_interval=ASSET_CACHE_CHECK_INTERVAL):
+        self.budget_bytes = budget_bytes
+        self.check_interval = check_interval
+        self.used_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _mtime(path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+
+    @staticmethod
+    def _nbytes(image):
+        if image is None:
+            return 0
+        return image.size[0] * image.size[1] * len(image.getbands())
+
+    def get(self, path, size=None, max_size=None):
+        key = (path, size, max_size)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                mtime, checked_at, image = entry
+                fresh = now - checked_at < self.check_interval
+                # Only an actual stat restarts the interval, so hot assets are still re-checked
+                if not fresh and self._mtime(path) == mtime:
+                    self._entries[key] = (mtime, now, image)
+                    fresh = True
+                if fresh:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    count_event('asset_cache_hit')
+                    return image
+                self._discard(key)
+            self.misses += 1
+            count_event('asset_cache_miss')
+
+        mtime = self._mtime(path)
+        image = load_local_image(path) if mtime is not None else None
+        if image is not None:
+            if size is not None and image.mode != 'RGB':
+                image = image.convert('RGB')
+            if size is not None and image.size != size:
+                image = image.resize(size, Image.Resampling.LANCZOS)
+            elif max_size is not None:
+                image = resize_character(image, max_size)
+
+        with self._lock:
+            if key in self._entries:
+                self._discard(key)
+            self._entries[key] = (mtime, now, image)
+            self.used_bytes += self._nbytes(image)
+            while self.used_bytes > self.budget_bytes and len(self._entries) > 1:
+                oldest = next(iter(self._entries))
+                self._discard(oldest)
+                self.evictions += 1
+        return image
+
+    def version(self, path):
+        # mtime of the copy being served for path, or None if it is not cached
+        with self._lock:
+            mtimes = [entry[0] for key, entry in self._entries.items() if key[0] == path]
+        return max(mtimes, default=None)
+
+    def _discard(self, key):
+        _, _, image = self._entries.pop(key)
+        self.used_bytes -= self._nbytes(image)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.used_bytes = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': len(self._entries), 'used_bytes': self.used_bytes,
+                'budget_bytes': self.budget_bytes,
+            }
+
+@process_cache
+def get_asset_cache():
+    return AssetCache(ASSET_CACHE_BUDGET_MB * 1024 * 1024)
+
+# Asset file naming convention: files under a Background(s) folder or named bg-1, background_2, ... are
+# backgrounds; other files are characters whose path names a gender and an emotion ("Girl/Girl Joy.jpg",
+# "male_sad.png", "boy angry.png"). Aliases are matched as substrings, so "female" is tried before "male"
+GENDER_ALIASES = {'female': ('female', 'girl', 'woman'), 'male': ('male', 'boy')}
+EMOTION_ALIASES = {
+    'joy': ('joy', 'happy'), 'sadness': ('sad',), 'anger': ('anger', 'angry'),
+    'fear': ('fear', 'scared', 'afraid'), 'surprise': ('surprise',), 'disgust': ('disgust',),
+    'neutral': ('neutral',), 'default': ('default',),
+}
+BACKGROUND_NAME = re.compile(r'^(bg|background)[-_ ]?\d+$')
+ASSET_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp', '.bmp')
+
+def classify_asset(relative_path):
+    # Returns ('background', None), ('character', 'female_joy') or None for files the convention does not name
+    parts = relative_path.lower().replace('\\', '/').split('/')
+    stem = os.path.splitext(parts[-1])[0]
+    if any(part in ('background', 'backgrounds') for part in parts[:-1]) or BACKGROUND_NAME.match(stem):
+        return 'background', None
+    name = '/'.join(parts)
+    gender = next((g for g, aliases in GENDER_ALIASES.items() if any(a in name for a in aliases)), None)
+    emotion = next((e for e, aliases in EMOTION_ALIASES.items() if any(a in stem for a in aliases)), None)
+    if gender and emotion:
+        return 'character', f"{gender}_{emotion}"
+    return None
+
+def trim_character(image, max_size=CHARACTER_MAX_SIZE):
+    # Crops to the opaque bounding box so transparent margins do not shift the character on the page
+    image = image.convert('RGBA')
+    bbox = image.getchannel('A').getbbox()
+    if bbox:
+        image = image.crop(bbox)
+    return resize_character(image, max_size)
+
+def build_asset_pack(images_dir, pack_path=ASSET_PACK, page_size=PAGE_SIZE, max_size=CHARACTER_MAX_SIZE):
+    # Writes raw pixels of every asset into one file and their offsets into <pack_path>.json; returns the index
+    files = []
+    for root, _, names in os.walk(images_dir):
+        for name in names:
+            if name.lower().endswith(ASSET_EXTENSIONS):
+                files.append(os.path.relpath(os.path.join(root, name), images_dir))
+    characters, backgrounds, skipped = {}, [], []
+    digest = hashlib.sha1()
+    with open(pack_path + '.tmp', 'wb') as pack:
+        def write(image, source):
+            data = image.tobytes()
+            entry = {'offset': pack.tell(), 'size': list(image.size), 'mode': image.mode, 'source': source}
+            pack.write(data)
+            digest.update(data)
+            return entry
+        for relative in sorted(files, key=lambda path: path.lower()):
+            kind = classify_asset(relative)
+            if kind is None or kind[1] in characters:
+                skipped.append(relative)
+                continue
+            try:
+                image = Image.open(os.path.join(images_dir, relative))
+                image.load()
+            except OSError:
+                skipped.append(relative)
+                continue
+            if kind[0] == 'background':
+                backgrounds.append(write(image.convert('RGB').resize(page_size, Image.Resampling.LANCZOS), relative))
+            else:
+                characters[kind[1]] = write(trim_character(image, max_size), relative)
+    index = {
+        'version': ASSET_PACK_VERSION, 'digest': digest.hexdigest(), 'page_size': list(page_size),
+        'character_max_size': max_size, 'characters': characters, 'backgrounds': backgrounds, 'skipped': skipped,
+    }
+    with open(pack_path + '.json.tmp', 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=1)
+    os.replace(pack_path + '.tmp', pack_path)
+    os.replace(pack_path + '.json.tmp', pack_path + '.json')
+    return index
+
+class AssetPack:
+    # Opened once per process; images are read-only views over the memory-mapped pack, so nothing is
+    # decoded or copied until a page pastes them
+    def __init__(self, pack_path):
+        with open(pack_path + '.json', encoding='utf-8') as f:
+            self.index = json.load(f)
+        if self.index.get('version') != ASSET_PACK_VERSION:
+            raise ValueError(f"{pack_path} was built by another version, rebuild it with `cli.py assets`")
+        self.digest = self.index['digest']
+        self.page_size = tuple(self.index['page_size'])
+        self.character_max_size = self.index['character_max_size']
+        with open(pack_path, 'rb') as f:
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) if os.fstat(f.fileno()).st_size else b''
+        self.characters = {key: self._image(entry) for key, entry in self.index['characters'].items()}
+        self.backgrounds = [self._image(entry) for entry in self.index['backgrounds']]
+
+    def _image(self, entry):
+        mode, size = entry['mode'], tuple(entry['size'])
+        length = size[0] * size[1] * len(mode)
+        buffer = memoryview(self._map)[entry['offset']:entry['offset'] + length]
+        return Image.frombuffer(mode, size, buffer, 'raw', mode, 0, 1)
+
+    def character_key(self, gender, emotion):
+        return next((key for key in character_keys(gender, emotion) if key in self.characters), None)
+
+    def character(self, gender, emotion):
+        key = self.character_key(gender, emotion)
+        return self.characters[key] if key else None
+
+    def background_index(self, page_number, size=PAGE_SIZE):
+        if not self.backgrounds or tuple(size) != self.page_size:
+            return None
+        return page_number % len(self.backgrounds)
+
+@process_cache
+def get_asset_pack():
+    if not ASSET_PACK or not os.path.exists(ASSET_PACK):
+        return None
+    try:
+        return AssetPack(ASSET_PACK)
+    except (OSError, ValueError, KeyError) as e:
+        st.warning(f"Asset pack not used: {e}")
+        return None
+
+@process_cache
 def create_default_background():
-    img = Image.new('RGB', (800, 600), '#87CEEB')
+    img = Image.new('RGB', PAGE_SIZE, '#87CEEB')
     draw = ImageDraw.Draw(img)
     cloud_positions = [(100, 80), (300, 60), (600, 90), (150, 120)]
     for pos in cloud_positions:
@@ -129,11 +1082,16 @@ def create_default_background():
         draw.ellipse([x-30, 300, x+50, 370], fill='#228B22')
     return img
 
-def get_background_image(page_number=0):
+@instrumented()
+def get_background_image(page_number=0, size=PAGE_SIZE):
+    pack = get_asset_pack()
+    index = pack.background_index(page_number, size) if pack is not None else None
+    if index is not None:
+        return pack.backgrounds[index]
     if BACKGROUND_IMAGES:
         bg_index = page_number % len(BACKGROUND_IMAGES)
         bg_path = BACKGROUND_IMAGES[bg_index]
-        image = load_local_image(bg_path)
+        image = get_asset_cache().get(bg_path, size=size)
         if image:
             return image
     return create_default_background()
@@ -171,23 +1129,23 @@ def create_fallback_character(gender, emotion):
         draw.line([(90, 110), (110, 110)], fill='black', width=2)
     return img
 
-def get_character_image(gender, emotion):
-    key = f"{gender}_{emotion}"
-    if key in CHARACTER_IMAGES:
-        image = load_local_image(CHARACTER_IMAGES[key])
-        if image: return image
-    
-    fallback_key = f"{gender}_default"
-    if fallback_key in CHARACTER_IMAGES:
-        image = load_local_image(CHARACTER_IMAGES[fallback_key])
-        if image: return image
-        
-    neutral_key = f"{gender}_neutral"
-    if neutral_key in CHARACTER_IMAGES:
-        image = load_local_image(CHARACTER_IMAGES[neutral_key])
-        if image: return image
-        
-    return create_fallback_character(gender, emotion)
+def character_keys(gender, emotion):
+    return (f"{gender}_{emotion}", f"{gender}_default", f"{gender}_neutral")
+
+@instrumented()
+def get_character_image(gender, emotion, max_size=None):
+    pack = get_asset_pack()
+    image = pack.character(gender, emotion) if pack is not None else None
+    if image is not None:
+        return resize_character(image, max_size) if max_size else image
+    cache = get_asset_cache()
+    for key in character_keys(gender, emotion):
+        if key in CHARACTER_IMAGES:
+            image = cache.get(CHARACTER_IMAGES[key], max_size=max_size)
+            if image: return image
+
+    image = create_fallback_character(gender, emotion)
+    return resize_character(image, max_size) if max_size else image
 
 def resize_character(image, max_size=280):
     width, height = image.size
@@ -198,137 +1156,1085 @@ def resize_character(image, max_size=280):
         return image.resize((new_width, new_height), Image.Resampling.LANCZOS)
     return image
 
-def create_speech_bubble(text, max_width=200):
-    try:
-        font = ImageFont.truetype("arial.ttf", 16)
-    except:
-        font = ImageFont.load_default()
-    
-    max_chars = max(15, max_width // 10)
-    wrapped_text = textwrap.fill(text, width=max_chars)
-    lines = wrapped_text.split('\n')
-    line_height = 20
-    text_height = len(lines) * line_height
-    
-    max_line_width = 0
-    for line in lines:
-        bbox = font.getbbox(line)
-        line_width = bbox[2] - bbox[0]
-        max_line_width = max(max_line_width, line_width)
-    
-    padding = 15
-    bubble_width = max_line_width + (padding * 2)
-    bubble_height = text_height + (padding * 2)
-    
-    bubble_img = Image.new('RGBA', (bubble_width + 20, bubble_height + 20), (0, 0, 0, 0))
-    draw = ImageDraw.Draw(bubble_img)
-    draw.rounded_rectangle([10, 0, bubble_width + 10, bubble_height], radius=15, fill='white', outline='black', width=2)
-    pointer_x = bubble_width // 2 + 10
-    draw.polygon([(pointer_x - 10, bubble_height), (pointer_x + 10, bubble_height), (pointer_x, bubble_height + 15)], fill='white', outline='black')
-    
-    y_offset = padding
-    for line in lines:
-        bbox = font.getbbox(line)
-        line_width = bbox[2] - bbox[0]
-        x_offset = (bubble_width - line_width) // 2 + 10
-        draw.text((x_offset, y_offset), line, fill='black', font=font)
-        y_offset += line_height
+BUBBLE_FONT_SIZE = 16
+BUBBLE_MIN_FONT_SIZE = 11
+BUBBLE_MAX_TEXT_HEIGHT = 240
+
+BUBBLE_PADDING = 15
+
+def speech_bubble_layout(text, max_width=200):
+    # Returns the text layout and the (width, height) of the bubble including its pointer
+    layout = layout_text(text, BUBBLE_FONT_SIZE, max_width - (BUBBLE_PADDING * 2), 20,
+                         max_height=BUBBLE_MAX_TEXT_HEIGHT, min_font_size=BUBBLE_MIN_FONT_SIZE)
+    return layout, (layout.width + (BUBBLE_PADDING * 2) + 20, layout.height + (BUBBLE_PADDING * 2) + 20)
+
+def draw_speech_bubble(draw, layout, x=0, y=0):
+    # draw is an ImageDraw or a PdfDraw; (x, y) is the bubble's top-left corner
+    bubble_width = layout.width + (BUBBLE_PADDING * 2)
+    bubble_height = layout.height + (BUBBLE_PADDING * 2)
+    draw.rounded_rectangle([x + 10, y, x + bubble_width + 10, y + bubble_height], radius=15, fill='white', outline='black', width=2)
+    pointer_x = x + bubble_width // 2 + 10
+    pointer_y = y + bubble_height
+    draw.polygon([(pointer_x - 10, pointer_y), (pointer_x + 10, pointer_y), (pointer_x, pointer_y + 15)], fill='white', outline='black')
+    layout.draw(draw, x + BUBBLE_PADDING + 10, y + BUBBLE_PADDING, fill='black', box_width=layout.width)
+
+@instrumented("create_speech_bubble")
+def render_speech_bubble(layout, size):
+    bubble_img = Image.new('RGBA', size, (0, 0, 0, 0))
+    draw_speech_bubble(ImageDraw.Draw(bubble_img), layout)
     return bubble_img
 
-def create_comic_page(message_pair, page_number, user_genders):
-    background = get_background_image(page_number)
-    bg_width, bg_height = background.size
-    target_width, target_height = 800, 600
-    if bg_width != target_width or bg_height != target_height:
-        background = background.resize((target_width, target_height), Image.Resampling.LANCZOS)
-    
-    page = background.copy()
-    
+def create_speech_bubble(text, max_width=200):
+    return render_speech_bubble(*speech_bubble_layout(text, max_width))
+
+def layout_comic_page(message_pair, page_number, user_genders):
+    # Everything drawn over the background, in page pixels and paint order:
+    # ('character', image, x, y) and ('bubble', (layout, size), x, y)
+    target_width, target_height = PAGE_SIZE
+    items = []
     for i, (speaker, message, emotion) in enumerate(message_pair):
         gender = user_genders[speaker]
-        char_image = get_character_image(gender, emotion)
-        char_image = resize_character(char_image, 250)
-        speech_bubble = create_speech_bubble(message, 300)
+        char_image = get_character_image(gender, emotion, CHARACTER_MAX_SIZE)
+        bubble = speech_bubble_layout(message, 300)
+        bubble_width, bubble_height = bubble[1]
         
         if speaker == 'User A':
             char_x = 40
             char_y = target_height - char_image.size[1] - 10
             bubble_x = char_x + 30
-            bubble_y = char_y - speech_bubble.size[1] - 15
+            bubble_y = char_y - bubble_height - 15
         else:
             char_x = target_width - char_image.size[0] - 40
             char_y = target_height - char_image.size[1] - 10
             bubble_x = char_x - 30
-            bubble_y = char_y - speech_bubble.size[1] - 15
+            bubble_y = char_y - bubble_height - 15
         
         if len(message_pair) == 2 and i == 1:
             char_y = target_height - char_image.size[1] - 10
-            bubble_y = char_y - speech_bubble.size[1] - 15
+            bubble_y = char_y - bubble_height - 15
             if i == 1 and bubble_y < 120:
                 bubble_y = 60
-        
-        if char_image.mode == 'RGBA':
-            page.paste(char_image, (char_x, char_y), char_image)
+        # Bubbles are sized by measured text width, keep them on the page
+        bubble_x = max(0, min(bubble_x, target_width - bubble_width))
+        bubble_y = max(0, bubble_y)
+        items.append(('character', char_image, char_x, char_y))
+        items.append(('bubble', bubble, bubble_x, bubble_y))
+    return items
+
+def draw_page_number(draw, page_number):
+    target_width, target_height = PAGE_SIZE
+    draw.text((target_width - 60, target_height - 25), f"Page {page_number + 1}", fill='black', font=get_font(12))
+
+@instrumented()
+def create_comic_page(message_pair, page_number, user_genders):
+    # Cached assets are shared across sessions: composite onto a copy, never in place
+    page = get_background_image(page_number).copy()
+    
+    for kind, item, x, y in layout_comic_page(message_pair, page_number, user_genders):
+        if kind == 'bubble':
+            speech_bubble = render_speech_bubble(*item)
+            page.paste(speech_bubble, (x, y), speech_bubble)
+        elif item.mode == 'RGBA':
+            page.paste(item, (x, y), item)
         else:
-            page.paste(char_image, (char_x, char_y))
-        page.paste(speech_bubble, (bubble_x, bubble_y), speech_bubble)
+            page.paste(item, (x, y))
     
-    draw = ImageDraw.Draw(page)
+    draw_page_number(ImageDraw.Draw(page), page_number)
+    return page
+
+class RenderCache:
+    # The render pool's processes write pages too, so the directory itself is the index. Each process adds
+    # its own writes to the total of the last listing and re-lists the directory once that estimate is over
+    # the budget, once it has written (1 - low_water) of the budget since (which bounds what the other
+    # processes can add unseen), or after scan_interval seconds. The least recently used pages (hits touch
+    # the mtime) are evicted down to low_water of the budget, so a full cache is not re-listed on every write
+    def __init__(self, directory, max_bytes, scan_interval=RENDER_CACHE_SCAN_INTERVAL, low_water=0.9):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.scan_interval = scan_interval
+        self.low_water = low_water
+        self.scanned_at = 0.0
+        self.scans = 0
+        self.written_bytes = 0
+        self.used_bytes = 0
+        self.entries = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._enforce_budget()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.png')
+
+    def _scan(self):
+        # (mtime, name, size) of every page, oldest first
+        files = []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                if not entry.name.endswith('.png'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue  # evicted by another process meanwhile
+                files.append((stat.st_mtime_ns, entry.name, stat.st_size))
+        files.sort()
+        return files
+
+    def _enforce_budget(self, keep=None):
+        files = self._scan()
+        used = sum(size for _, _, size in files)
+        target = self.max_bytes * self.low_water if used > self.max_bytes else self.max_bytes
+        evicted = 0
+        for _, name, size in files:
+            if used <= target:
+                break
+            if name == keep:
+                continue
+            try:
+                os.unlink(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                pass
+            except OSError:
+                continue
+            used -= size
+            evicted += 1
+        with self._lock:
+            self.used_bytes = used
+            self.entries = len(files) - evicted
+            self.evictions += evicted
+            self.scanned_at = time.monotonic()
+            self.scans += 1
+            self.written_bytes = 0
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+            os.utime(path, None)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        temp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError:
+            return
+        with self._lock:
+            self.used_bytes += len(data)
+            self.written_bytes += len(data)
+            self.entries += 1
+            due = (self.used_bytes > self.max_bytes or self.written_bytes > self.max_bytes * (1 - self.low_water)
+                   or time.monotonic() - self.scanned_at >= self.scan_interval)
+        if due:
+            self._enforce_budget(keep=os.path.basename(path))
+
+    def stats(self):
+        with self._lock:
+            return {
+                'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                'entries': self.entries, 'used_bytes': self.used_bytes,
+                'budget_bytes': self.max_bytes, 'scans': self.scans,
+            }
+
+@process_cache
+def get_render_cache():
+    if RENDER_CACHE_MAX_MB <= 0:
+        return None
     try:
-        font = ImageFont.truetype("arial.ttf", 12)
-    except:
-        font = ImageFont.load_default()
-    page_text = f"Page {page_number + 1}"
-    draw.text((target_width - 60, target_height - 25), page_text, fill='black', font=font)
+        return RenderCache(os.path.join(RENDER_CACHE_DIR, "pages"), RENDER_CACHE_MAX_MB * 1024 * 1024)
+    except OSError as e:
+        st.warning(f"Render cache disabled: {e}")
+        return None
+
+def _asset_version(path):
+    # The version the asset cache is serving, which lags the file by up to ASSET_CACHE_CHECK_INTERVAL,
+    # so a page is keyed by the pixels it is actually drawn from
+    if not path:
+        return None
+    version = get_asset_cache().version(path)
+    if version is None:
+        try:
+            version = os.stat(path).st_mtime_ns
+        except OSError:
+            return None
+    return version
+
+def page_cache_key(message_pair, page_number, user_genders):
+    # Pack assets are identified by the pack digest, loose files by their modification time and size
+    pack = get_asset_pack()
+    background_index = pack.background_index(page_number) if pack is not None else None
+    if background_index is not None:
+        background = ['pack', background_index]
+    else:
+        path = BACKGROUND_IMAGES[page_number % len(BACKGROUND_IMAGES)] if BACKGROUND_IMAGES else None
+        background = [path, _asset_version(path)]
+    characters = []
+    for speaker, _, emotion in message_pair:
+        gender = user_genders[speaker]
+        pack_key = pack.character_key(gender, emotion) if pack is not None else None
+        if pack_key:
+            characters.append([gender, ['pack', pack_key]])
+            continue
+        paths = [CHARACTER_IMAGES.get(key) for key in character_keys(gender, emotion)]
+        characters.append([gender, [[path, _asset_version(path)] for path in paths]])
+    payload = {
+        'renderer': RENDERER_VERSION,
+        'page_number': page_number,
+        'messages': [list(message) for message in message_pair],
+        'characters': characters,
+        'background': background,
+        'pack': pack.digest if pack is not None else None,
+        'font': resolve_font_path(),
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode('utf-8')).hexdigest()
+
+@instrumented()
+def encode_page_png(page):
+    buffer = io.BytesIO()
+    page.save(buffer, format='PNG', compress_level=3)
+    return buffer.getvalue()
+
+def render_comic_page_cached(message_pair, page_number, user_genders):
+    cache = get_render_cache()
+    if cache is None:
+        return create_comic_page(message_pair, page_number, user_genders)
+    key = page_cache_key(message_pair, page_number, user_genders)
+    data = cache.get(key)
+    if data is not None:
+        count_event('render_cache_hit')
+        page = Image.open(io.BytesIO(data))
+        page.load()
+        return page
+    count_event('render_cache_miss')
+    page = create_comic_page(message_pair, page_number, user_genders)
+    # An asset refreshed mid-render changes the key; such a page is not stored under either one
+    if page_cache_key(message_pair, page_number, user_genders) == key:
+        cache.put(key, encode_page_png(page))
     return page
 
-def create_comic_pdf(pages):
-    if not pages: return None
-    temp_pdf = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-    temp_pdf.close()
-    temp_files = []
+def render_comic_page_png(message_pair, page_number, user_genders):
+    # Encoded page for the page store; a render cache hit is returned without being decoded
+    cache = get_render_cache()
+    key = page_cache_key(message_pair, page_number, user_genders) if cache is not None else None
+    if cache is not None:
+        data = cache.get(key)
+        if data is not None:
+            count_event('render_cache_hit')
+            return data
+        count_event('render_cache_miss')
+    data = encode_page_png(create_comic_page(message_pair, page_number, user_genders))
+    if cache is not None and page_cache_key(message_pair, page_number, user_genders) == key:
+        cache.put(key, data)
+    return data
+
+class PageBudget:
+    # Process-wide cap on the PNG bytes all sessions' page stores hold in memory
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._stores = weakref.WeakSet()
+        self._lock = threading.Lock()
+
+    def register(self, store):
+        with self._lock:
+            self._stores.add(store)
+
+    def reclaim(self):
+        # Spills the oldest in-memory page of the largest session until the total fits
+        while True:
+            with self._lock:
+                stores = list(self._stores)
+            if sum(store.memory_bytes for store in stores) <= self.max_bytes:
+                return
+            victim = max(stores, key=lambda store: store.memory_bytes)
+            if not victim.spill_oldest():
+                return
+
+    def stats(self):
+        with self._lock:
+            stores = list(self._stores)
+        return {
+            'sessions': len(stores), 'pages': sum(len(store) for store in stores),
+            'used_bytes': sum(store.memory_bytes for store in stores),
+            'disk_bytes': sum(store.disk_bytes for store in stores),
+            'budget_bytes': self.max_bytes,
+        }
+
+class PageStore:
+    # Comic pages of one session as PNG bytes. Pages over the session budget (or the shared
+    # PageBudget) are spilled to disk oldest first; only the last few pages read stay decoded
+    def __init__(self, max_bytes, budget=None, directory=PAGE_STORE_DIR, hot_pages=PAGE_STORE_HOT_PAGES):
+        self.max_bytes = max_bytes
+        self.budget = budget
+        self.directory = os.path.join(directory, uuid.uuid4().hex)
+        self.hot_pages = hot_pages
+        self.memory_bytes = 0
+        self.disk_bytes = 0
+        self.spills = 0
+        self._pages = []  # PNG bytes, or the path of a spilled page
+        self._digests = []
+        self._spilled = 0  # spilled pages are always a prefix of _pages
+        self._generation = 0
+        self._hot = OrderedDict()
+        self._thumbnails = OrderedDict()
+        self._lock = threading.Lock()
+        # Spilled files go away with the session
+        weakref.finalize(self, shutil.rmtree, self.directory, True)
+        if budget is not None:
+            budget.register(self)
+
+    def __len__(self):
+        return len(self._pages)
+
+    def append(self, page):
+        data = bytes(page) if isinstance(page, (bytes, bytearray, memoryview)) else encode_page_png(page)
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            self._pages.append(data)
+            self._digests.append(digest)
+            self.memory_bytes += len(data)
+        self._enforce_budgets()
+
+    def set(self, index, page):
+        # Replaces a page in place; a spilled page is rewritten on disk
+        data = bytes(page) if isinstance(page, (bytes, bytearray, memoryview)) else encode_page_png(page)
+        digest = hashlib.sha1(data).hexdigest()
+        with self._lock:
+            entry = self._pages[index]
+            if isinstance(entry, bytes):
+                self._pages[index] = data
+                self.memory_bytes += len(data) - len(entry)
+            else:
+                old_size = os.path.getsize(entry)
+                with open(entry + '.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(entry + '.tmp', entry)
+                self.disk_bytes += len(data) - old_size
+            self._digests[index] = digest
+            self._hot.pop(index, None)
+            for key in [key for key in self._thumbnails if key[1] == index]:
+                del self._thumbnails[key]
+        self._enforce_budgets()
+
+    def _enforce_budgets(self):
+        while self.memory_bytes > self.max_bytes and self.spill_oldest():
+            pass
+        if self.budget is not None:
+            self.budget.reclaim()
+
+    def extend(self, pages):
+        for page in pages:
+            self.append(page)
+
+    def spill_oldest(self):
+        with self._lock:
+            if self._spilled >= len(self._pages):
+                return False
+            index = self._spilled
+            data = self._pages[index]
+            path = os.path.join(self.directory, f"{self._generation}-{index}.png")
+            try:
+                os.makedirs(self.directory, exist_ok=True)
+                with open(path, 'wb') as f:
+                    f.write(data)
+            except OSError:
+                # Stays in memory; the budget is exceeded rather than the page lost
+                return False
+            self._pages[index] = path
+            self._spilled += 1
+            self.memory_bytes -= len(data)
+            self.disk_bytes += len(data)
+            self.spills += 1
+        count_event('page_store_spill')
+        return True
+
+    def png(self, index):
+        entry = self._pages[index]
+        if isinstance(entry, bytes):
+            return entry
+        with open(entry, 'rb') as f:
+            return f.read()
+
+    def iter_png(self, count=None):
+        for index in range(len(self._pages) if count is None else count):
+            yield self.png(index)
+
+    def content_key(self, count=None):
+        # Identifies the first `count` pages by content, without reading spilled pages back
+        with self._lock:
+            digests = self._digests[:count]
+        return hashlib.sha1(''.join(digests).encode('ascii')).hexdigest()
+
+    def get(self, index):
+        with self._lock:
+            page = self._hot.get(index)
+            if page is not None:
+                self._hot.move_to_end(index)
+                return page
+        page = Image.open(io.BytesIO(self.png(index)))
+        page.load()
+        with self._lock:
+            self._hot[index] = page
+            while len(self._hot) > self.hot_pages:
+                self._hot.popitem(last=False)
+        return page
+
+    @instrumented("page_thumbnail")
+    def _encode_thumbnail(self, index, width):
+        page = Image.open(io.BytesIO(self.png(index)))
+        page.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        page.convert('RGB').save(buffer, format='JPEG', quality=80)
+        return buffer.getvalue()
+
+    def thumbnail(self, index, width=COMIC_THUMBNAIL_WIDTH):
+        # Downscaled JPEG for the gallery, encoded once per page and kept for the most recent pages shown
+        with self._lock:
+            key = (self._generation, index, width)
+            data = self._thumbnails.get(key)
+            if data is not None:
+                self._thumbnails.move_to_end(key)
+                return data
+        data = self._encode_thumbnail(index, width)
+        with self._lock:
+            self._thumbnails[key] = data
+            while len(self._thumbnails) > PAGE_STORE_THUMBNAILS:
+                self._thumbnails.popitem(last=False)
+        return data
+
+    def clear(self):
+        with self._lock:
+            self._pages = []
+            self._digests = []
+            self._spilled = 0
+            self._generation += 1
+            self._hot.clear()
+            self._thumbnails.clear()
+            self.memory_bytes = 0
+            self.disk_bytes = 0
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'pages': len(self._pages), 'spilled': self._spilled, 'spills': self.spills,
+                'decoded': len(self._hot), 'thumbnails': len(self._thumbnails), 'used_bytes': self.memory_bytes,
+                'disk_bytes': self.disk_bytes, 'budget_bytes': self.max_bytes,
+            }
+
+@st.cache_resource
+def get_page_budget():
+    return PageBudget(int(PAGE_STORE_GLOBAL_MB * 1024 * 1024))
+
+def new_page_store():
+    return PageStore(int(PAGE_STORE_SESSION_MB * 1024 * 1024), get_page_budget())
+
+CONVERSATION_ID = re.compile(r'^[0-9a-f]{16}$')
+
+def conversation_path(conversation_id):
+    return os.path.join(RENDER_CACHE_DIR, "conversations", conversation_id + ".json")
+
+def conversation_expired(mtime, now=None):
+    return CONVERSATION_MAX_DAYS > 0 and (now or time.time()) - mtime > CONVERSATION_MAX_DAYS * 86400
+
+@process_cache
+def get_conversation_prune_state():
+    return {'pruned_at': None}
+
+def prune_conversations():
+    # Deletes conversations idle for longer than CONVERSATION_MAX_DAYS; returns how many
+    removed = 0
+    now = time.time()
+    try:
+        entries = list(os.scandir(os.path.join(RENDER_CACHE_DIR, "conversations")))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.name.endswith('.json') and conversation_expired(entry.stat().st_mtime, now):
+                os.unlink(entry.path)
+                removed += 1
+        except OSError:
+            continue
+    return removed
+
+def save_conversation(conversation_id, messages, user_genders):
+    if not SAVE_CONVERSATIONS:
+        return
+    state = get_conversation_prune_state()
+    if state['pruned_at'] is None or time.monotonic() - state['pruned_at'] > CONVERSATION_PRUNE_INTERVAL:
+        state['pruned_at'] = time.monotonic()
+        prune_conversations()
+    path = conversation_path(conversation_id)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path + ".tmp", 'w', encoding='utf-8') as f:
+            json.dump({'messages': [list(m) for m in messages], 'user_genders': user_genders}, f)
+        os.replace(path + ".tmp", path)
+    except OSError:
+        pass
+
+def load_conversation(conversation_id):
+    if not SAVE_CONVERSATIONS or not conversation_id or not CONVERSATION_ID.match(conversation_id):
+        return None
+    try:
+        path = conversation_path(conversation_id)
+        if conversation_expired(os.stat(path).st_mtime):
+            return None
+        with open(path, encoding='utf-8') as f:
+            data = json.load(f)
+        return [tuple(m) for m in data['messages']], data['user_genders']
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _get_query_param(name):
+    if hasattr(st, 'query_params'):
+        return st.query_params.get(name)
+    return st.experimental_get_query_params().get(name, [None])[0]
+
+def _set_query_param(name, value):
+    if hasattr(st, 'query_params'):
+        st.query_params[name] = value
+    else:
+        st.experimental_set_query_params(**{name: value})
+
+def warm_render_caches():
+    # Pool initializer: each worker process loads fonts and assets once, before its first page. Workers
+    # have no Streamlit script run, so everything warmed here must be a process_cache (or module-level)
+    # cache; an st.cache_resource function would be rebuilt on every call
+    try:
+        from streamlit import logger as st_logger
+        st_logger.set_log_level("error")
+    except Exception:
+        pass
+    for size in (12, 16):
+        get_font(size)
+    get_render_cache()
+    create_default_background()
+    if get_asset_pack() is not None:
+        return
+    cache = get_asset_cache()
+    for path in BACKGROUND_IMAGES:
+        cache.get(path, size=PAGE_SIZE)
+    for path in CHARACTER_IMAGES.values():
+        cache.get(path, max_size=CHARACTER_MAX_SIZE)
+
+def _render_page_task(message_pair, page_number, user_genders):
+    return render_comic_page_cached(message_pair, page_number, user_genders)
+
+def _render_page_png_task(message_pair, page_number, user_genders):
+    return render_comic_page_png(message_pair, page_number, user_genders)
+
+def _renderer_module():
+    # Under `streamlit run` this file executes as __main__, which worker processes cannot
+    # unpickle tasks from; import it again under its file name for them
+    if __name__ != '__main__':
+        return sys.modules[__name__]
+    return importlib.import_module(os.path.splitext(os.path.basename(__file__))[0])
+
+def create_render_executor(kind=RENDER_EXECUTOR, workers=RENDER_WORKERS):
+    if kind == 'process':
+        return ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_renderer_module().warm_render_caches,
+        )
+    if kind == 'thread':
+        return ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render')
+    raise ValueError(f"Unknown render executor: {kind}")
+
+@process_cache
+def get_render_executor(kind=RENDER_EXECUTOR, workers=RENDER_WORKERS):
+    return create_render_executor(kind, workers)
+
+def iter_ordered_results(executor, task, arg_tuples, window=None):
+    # Yields task results in submission order, keeping at most `window` tasks in flight
+    window = window or getattr(executor, '_max_workers', RENDER_WORKERS) * 2
+    pending = deque()
+    try:
+        for args in arg_tuples:
+            pending.append(executor.submit(task, *args))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
+
+def render_comic_pages(message_pairs, user_genders, start_page=0, executor=None, encoded=False):
+    # Yields (page_number, page) in page order, each as soon as it and all earlier pages are done;
+    # encoded=True yields PNG bytes instead of images. message_pairs may be a generator, which is
+    # only read as far as the pool has room for
+    render = render_comic_page_png if encoded else render_comic_page_cached
+    if isinstance(message_pairs, (list, tuple)) and len(message_pairs) <= 1:
+        for i, pair in enumerate(message_pairs):
+            yield start_page + i, render(pair, start_page + i, user_genders)
+        return
+    executor = executor or get_render_executor()
+    task = _render_page_png_task if encoded else _render_page_task
+    if isinstance(executor, ProcessPoolExecutor):
+        task = getattr(_renderer_module(), task.__name__)
+    args = ((pair, start_page + i, user_genders) for i, pair in enumerate(message_pairs))
+    for i, page in enumerate(iter_ordered_results(executor, task, args)):
+        yield start_page + i, page
+
+PDF_PAGE_ENCODINGS = ('lossless', 'jpeg')
+PDF_PAGE_SIZE = (595.2756, 841.8898)  # A4 in points
+PDF_MARGIN = 50
+# ImageReaders kept by the vector exports for images drawn again on later pages
+PDF_IMAGE_READERS = 16
+
+def fit_on_pdf_page(image_size, page_size=PDF_PAGE_SIZE, margin=PDF_MARGIN):
+    # Largest centred (x, y, width, height) box with the image's aspect ratio inside the margins
+    img_width, img_height = image_size
+    page_width, page_height = page_size
+    aspect_ratio = img_width / img_height
+    max_width = page_width - (2 * margin)
+    max_height = page_height - (2 * margin)
+    if aspect_ratio > max_width / max_height:
+        draw_width = max_width
+        draw_height = max_width / aspect_ratio
+    else:
+        draw_height = max_height
+        draw_width = max_height * aspect_ratio
+    return (page_width - draw_width) / 2, (page_height - draw_height) / 2, draw_width, draw_height
+
+@instrumented("pdf_page_encode")
+def _pdf_page_image(page, encoding, quality):
+    from reportlab.lib.utils import ImageReader
+    # Already-encoded page bytes are embedded as-is (JPEG data is passed straight through by ReportLab),
+    # unless PNG bytes have to be recompressed for the JPEG encoding
+    if isinstance(page, (bytes, bytearray, memoryview)):
+        if encoding != 'jpeg' or bytes(page[:2]) == b'\xff\xd8':
+            return ImageReader(io.BytesIO(page))
+        page = Image.open(io.BytesIO(page))
+    if encoding == 'jpeg':
+        buffer = io.BytesIO()
+        page.convert('RGB').save(buffer, format='JPEG', quality=quality, optimize=True)
+        buffer.seek(0)
+        return ImageReader(buffer)
+    return ImageReader(page)
+
+@instrumented()
+def create_comic_pdf(pages, encoding='lossless', quality=85, output=None):
+    # pages may be any iterable (e.g. a generator), so long documents never need every page in memory
+    if isinstance(pages, (list, tuple)) and not pages: return None
+    if encoding not in PDF_PAGE_ENCODINGS:
+        raise ValueError(f"Unknown PDF page encoding: {encoding}")
+    from reportlab.pdfgen import canvas
+    from reportlab.lib.pagesizes import A4
+    buffer = output if output is not None else io.BytesIO()
     
     try:
-        c = canvas.Canvas(temp_pdf.name, pagesize=A4)
+        c = canvas.Canvas(buffer, pagesize=A4)
         page_width, page_height = A4
-        for i, page_img in enumerate(pages):
-            temp_img = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-            temp_img_path = temp_img.name
-            temp_img.close()
-            temp_files.append(temp_img_path)
-            page_img.save(temp_img_path, 'PNG')
-            
-            img_width, img_height = page_img.size
-            aspect_ratio = img_width / img_height
-            margin = 50
-            max_width = page_width - (2 * margin)
-            max_height = page_height - (2 * margin)
-            
-            if aspect_ratio > max_width / max_height:
-                draw_width = max_width
-                draw_height = max_width / aspect_ratio
-            else:
-                draw_height = max_height
-                draw_width = max_height * aspect_ratio
-            
-            x = (page_width - draw_width) / 2
-            y = (page_height - draw_height) / 2
-            c.drawImage(temp_img_path, x, y, width=draw_width, height=draw_height)
-            if i < len(pages) - 1:
-                c.showPage()
+        page_count = 0
+        for page in pages:
+            page_img = _pdf_page_image(page, encoding, quality)
+            x, y, draw_width, draw_height = fit_on_pdf_page(page_img.getSize(), (page_width, page_height))
+            c.drawImage(page_img, x, y, width=draw_width, height=draw_height)
+            c.showPage()
+            page_count += 1
+        if page_count == 0: return None
         c.save()
-        return temp_pdf.name
+        return buffer if output is not None else buffer.getvalue()
     except Exception as e:
         st.error(f"Error creating PDF: {e}")
         return None
-    finally:
-        for temp_file in temp_files:
-            try:
-                if os.path.exists(temp_file): os.unlink(temp_file)
-            except: pass
+
+class StreamingPdfWriter:
+    # Writes each page (one image centred on A4) to output as soon as it is added, unlike ReportLab,
+    # which keeps the whole document until save(); only object offsets are held until close()
+    def __init__(self, output, encoding='lossless', quality=85):
+        if encoding not in PDF_PAGE_ENCODINGS:
+            raise ValueError(f"Unknown PDF page encoding: {encoding}")
+        self.output = output
+        self.encoding = encoding
+        self.quality = quality
+        self.position = 0
+        self.offsets = {}
+        self.page_ids = []
+        self._next_id = 3  # 1 is the catalog and 2 the page tree, both written by close()
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+
+    def _write(self, data):
+        self.output.write(data)
+        self.position += len(data)
+
+    def _object(self, body, stream=None, obj_id=None):
+        if obj_id is None:
+            obj_id = self._next_id
+            self._next_id += 1
+        self.offsets[obj_id] = self.position
+        if stream is None:
+            self._write(f"{obj_id} 0 obj\n<< {body} >>\nendobj\n".encode('ascii'))
+        else:
+            self._write(f"{obj_id} 0 obj\n<< {body} /Length {len(stream)} >>\nstream\n".encode('ascii'))
+            self._write(stream)
+            self._write(b"\nendstream\nendobj\n")
+        return obj_id
+
+    @instrumented("pdf_page_encode")
+    def _image_stream(self, page):
+        # JPEG bytes pass through as DCTDecode; anything else is embedded as Flate-compressed RGB
+        if isinstance(page, (bytes, bytearray, memoryview)):
+            data = bytes(page)
+            image = Image.open(io.BytesIO(data))
+            if data[:2] == b'\xff\xd8' and image.mode == 'RGB':
+                return image.size, 'DCTDecode', data
+            page = image
+        page = page.convert('RGB')
+        if self.encoding == 'jpeg':
+            buffer = io.BytesIO()
+            page.save(buffer, format='JPEG', quality=self.quality, optimize=True)
+            return page.size, 'DCTDecode', buffer.getvalue()
+        return page.size, 'FlateDecode', zlib.compress(page.tobytes(), 6)
+
+    def add_page(self, page):
+        (width, height), image_filter, data = self._image_stream(page)
+        image_id = self._object(f"/Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                                f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /{image_filter}", data)
+        self._page(image_id, fit_on_pdf_page((width, height)), PDF_PAGE_SIZE)
+
+    def add_image_page(self, size, bands, page_size):
+        # One image filling a page_size page, fed as RGB bands (top to bottom) and Flate-compressed as
+        # they arrive; the stream length is only known afterwards, so it is an indirect object
+        width, height = size
+        image_id, length_id = self._next_id, self._next_id + 1
+        self._next_id += 2
+        self.offsets[image_id] = self.position
+        self._write(f"{image_id} 0 obj\n<< /Type /XObject /Subtype /Image /Width {width} /Height {height} "
+                    f"/ColorSpace /DeviceRGB /BitsPerComponent 8 /Filter /FlateDecode /Length {length_id} 0 R >>\n"
+                    f"stream\n".encode('ascii'))
+        start = self.position
+        compressor = zlib.compressobj(6)
+        for band in bands:
+            self._write(compressor.compress(band.tobytes()))
+        self._write(compressor.flush())
+        length = self.position - start
+        self._write(b"\nendstream\nendobj\n")
+        self.offsets[length_id] = self.position
+        self._write(f"{length_id} 0 obj\n{length}\nendobj\n".encode('ascii'))
+        self._page(image_id, (0, 0) + tuple(page_size), page_size)
+
+    def _page(self, image_id, box, page_size):
+        x, y, draw_width, draw_height = box
+        content = f"q {draw_width:.2f} 0 0 {draw_height:.2f} {x:.2f} {y:.2f} cm /Im0 Do Q".encode('ascii')
+        content_id = self._object("", content)
+        page_width, page_height = page_size
+        self.page_ids.append(self._object(
+            f"/Type /Page /Parent 2 0 R /MediaBox [0 0 {page_width:.4f} {page_height:.4f}] "
+            f"/Resources << /XObject << /Im0 {image_id} 0 R >> >> /Contents {content_id} 0 R"))
+
+    def close(self):
+        kids = " ".join(f"{page_id} 0 R" for page_id in self.page_ids)
+        self._object(f"/Type /Pages /Kids [{kids}] /Count {len(self.page_ids)}", obj_id=2)
+        self._object("/Type /Catalog /Pages 2 0 R", obj_id=1)
+        xref_position = self.position
+        size = self._next_id
+        lines = [f"xref\n0 {size}\n", "0000000000 65535 f \n"]
+        lines += [f"{self.offsets[obj_id]:010d} 00000 n \n" for obj_id in range(1, size)]
+        lines.append(f"trailer\n<< /Size {size} /Root 1 0 R >>\nstartxref\n{xref_position}\n%%EOF\n")
+        self._write("".join(lines).encode('ascii'))
+        return len(self.page_ids)
+
+@process_cache
+def pdf_font_name(path):
+    # Registers a TTF with ReportLab once per process; Pillow's built-in font has no file, use Helvetica
+    if not isinstance(path, str):
+        return 'Helvetica'
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFont
+    name = f"font-{hashlib.sha1(path.encode('utf-8')).hexdigest()[:12]}"
+    try:
+        pdfmetrics.registerFont(TTFont(name, path))
+    except Exception:
+        return 'Helvetica'
+    return name
+
+class PdfDraw:
+    # ImageDraw stand-in for a ReportLab canvas, so the bubble and card text code written for Pillow
+    # draws vector shapes and text instead. Coordinates are image pixels from the top-left, mapped
+    # into box (x, y, width, height) on the PDF page
+    def __init__(self, canvas, box, image_size, readers=None):
+        self.canvas = canvas
+        self.left, self.bottom, box_width, _ = box
+        self.scale = box_width / image_size[0]
+        self.height = image_size[1]
+        # LRU of id(image) -> (image, ImageReader), shared by the pages of one document; holding the
+        # image keeps its id from being reused while the entry lives
+        self.readers = OrderedDict() if readers is None else readers
+
+    def point(self, x, y):
+        return self.left + x * self.scale, self.bottom + (self.height - y) * self.scale
+
+    def _paint(self, fill, outline, width=1):
+        # Sets the colours and returns ReportLab's (stroke, fill) flags
+        for color, set_rgb, set_alpha in ((fill, self.canvas.setFillColorRGB, self.canvas.setFillAlpha),
+                                          (outline, self.canvas.setStrokeColorRGB, self.canvas.setStrokeAlpha)):
+            if color is not None:
+                rgba = ImageColor.getrgb(color) if isinstance(color, str) else tuple(color)
+                set_rgb(*(channel / 255 for channel in rgba[:3]))
+                set_alpha(rgba[3] / 255 if len(rgba) > 3 else 1)
+        self.canvas.setLineWidth(width * self.scale)
+        return int(outline is not None), int(fill is not None)
+
+    def image(self, image, x, y):
+        # ReportLab names image XObjects by content digest, so a repeated image is embedded only once even
+        # when it is a new object (fallback characters are drawn fresh per page); the LRU only saves
+        # re-reading the pixels of the cached backgrounds and characters, and stays bounded on long exports
+        from reportlab.lib.utils import ImageReader
+        entry = self.readers.get(id(image))
+        if entry is None:
+            entry = self.readers[id(image)] = (image, ImageReader(image))
+            if len(self.readers) > PDF_IMAGE_READERS:
+                self.readers.popitem(last=False)
+        else:
+            self.readers.move_to_end(id(image))
+        left, bottom = self.point(x, y + image.size[1])
+        self.canvas.drawImage(entry[1], left, bottom, width=image.size[0] * self.scale, height=image.size[1] * self.scale,
+                              mask='auto' if image.mode in ('RGBA', 'LA') else None)
+
+    def rounded_rectangle(self, xy, radius=0, fill=None, outline=None, width=1):
+        stroke, filled = self._paint(fill, outline, width)
+        left, top = self.point(xy[0], xy[1])
+        right, bottom = self.point(xy[2], xy[3])
+        self.canvas.roundRect(left, bottom, right - left, top - bottom, radius * self.scale, stroke=stroke, fill=filled)
+
+    def polygon(self, xy, fill=None, outline=None, width=1):
+        stroke, filled = self._paint(fill, outline, width)
+        path = self.canvas.beginPath()
+        path.moveTo(*self.point(*xy[0]))
+        for point in xy[1:]:
+            path.lineTo(*self.point(*point))
+        path.close()
+        self.canvas.drawPath(path, stroke=stroke, fill=filled)
+
+    def text(self, xy, text, fill=None, font=None):
+        # Pillow places text by the top of the ascender, ReportLab by the baseline
+        self._paint(fill, None)
+        x, y = xy
+        ascent = font.getmetrics()[0] if hasattr(font, 'getmetrics') else 0
+        self.canvas.setFont(pdf_font_name(getattr(font, 'path', None)), getattr(font, 'size', 10) * self.scale)
+        self.canvas.drawString(*self.point(x, y + ascent), text)
+
+@instrumented()
+def create_comic_pdf_vector(message_pairs, user_genders, output=None, progress=None):
+    # Backgrounds and characters are embedded once and referenced by every page that reuses them;
+    # bubbles and text are vector shapes and text, so pages stay small and print sharply.
+    # message_pairs may be any iterable; each page only costs its drawing operators
+    from reportlab.pdfgen import canvas
+    buffer = output if output is not None else io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=PDF_PAGE_SIZE)
+    box = fit_on_pdf_page(PAGE_SIZE)
+    readers = OrderedDict()
+    page_count = 0
+    for page_number, message_pair in enumerate(message_pairs):
+        with timed('pdf_vector_page'):
+            draw = PdfDraw(c, box, PAGE_SIZE, readers)
+            draw.image(get_background_image(page_number), 0, 0)
+            for kind, item, x, y in layout_comic_page(message_pair, page_number, user_genders):
+                if kind == 'bubble':
+                    draw_speech_bubble(draw, item[0], x, y)
+                else:
+                    draw.image(item, x, y)
+            draw_page_number(draw, page_number)
+            c.showPage()
+        page_count += 1
+        if progress:
+            progress(page_count)
+    if page_count == 0: return None
+    c.save()
+    return buffer if output is not None else buffer.getvalue()
+
+# ==========================================
+# 6. HELPER FUNCTIONS: TRANSCRIPT IMPORT
+# ==========================================
+TRANSCRIPT_FORMATS = ('json', 'csv', 'whatsapp')
+SPEAKERS = ('User A', 'User B')
+
+# "12/31/20, 10:15 PM - Name: text" (Android) or "[31/12/2020, 22:15:03] Name: text" (iOS)
+WHATSAPP_LINE = re.compile(
+    r'^\[?(?P<date>\d{1,4}[./-]\d{1,2}[./-]\d{1,4}),?\s+'
+    r'(?P<time>\d{1,2}[:.]\d{2}(?:[:.]\d{2})?(?:\s?[APap]\.?[Mm]\.?)?)\]?\s*(?:-\s*)?'
+    r'(?P<speaker>[^:]+?):\s?(?P<message>.*)$'
+)
+WHATSAPP_STARTS_ENTRY = re.compile(r'^\[?\d{1,4}[./-]\d{1,2}[./-]\d{1,4},?\s+\d{1,2}[:.]\d{2}')
+
+def detect_transcript_format(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext == '.json':
+        return 'json'
+    if ext == '.csv':
+        return 'csv'
+    return 'whatsapp'
+
+def _transcript_entry(item):
+    if isinstance(item, dict):
+        speaker = item.get('speaker') or item.get('user') or item.get('name')
+        message = item.get('message') or item.get('text') or ''
+        emotion = item.get('emotion') or None
+    else:
+        speaker, message = item[0], item[1]
+        emotion = item[2] if len(item) > 2 else None
+    return str(speaker).strip(), str(message), (emotion.lower() if emotion else None)
+
+def parse_json_transcript(stream):
+    data = json.load(stream)
+    if isinstance(data, dict):
+        data = data.get('messages', [])
+    for item in data:
+        yield _transcript_entry(item)
+
+def parse_csv_transcript(stream):
+    for row in csv.DictReader(stream):
+        row = {key.strip().lower(): value for key, value in row.items() if key}
+        yield _transcript_entry(row)
+
+def parse_whatsapp_transcript(stream):
+    current = None
+    for raw_line in stream:
+        line = raw_line.rstrip('\r\n').replace('\u200e', '')
+        match = WHATSAPP_LINE.match(line)
+        if match:
+            if current:
+                yield current
+            current = (match.group('speaker').strip(), match.group('message'), None)
+        elif WHATSAPP_STARTS_ENTRY.match(line):
+            # System notice without a speaker ("Messages are end-to-end encrypted", ...)
+            if current:
+                yield current
+            current = None
+        elif current:
+            current = (current[0], current[1] + '\n' + line, None)
+    if current:
+        yield current
+
+TRANSCRIPT_PARSERS = {'json': parse_json_transcript, 'csv': parse_csv_transcript, 'whatsapp': parse_whatsapp_transcript}
+
+def iter_transcript_stream(stream, fmt):
+    if fmt not in TRANSCRIPT_PARSERS:
+        raise ValueError(f"Unknown transcript format: {fmt}")
+    for speaker, message, emotion in TRANSCRIPT_PARSERS[fmt](stream):
+        if message.strip():
+            yield speaker, message, emotion
+
+def iter_transcript(path, fmt=None):
+    fmt = fmt or detect_transcript_format(path)
+    if fmt not in TRANSCRIPT_PARSERS:
+        raise ValueError(f"Unknown transcript format: {fmt}")
+    with open(path, encoding='utf-8-sig', newline='' if fmt == 'csv' else None) as stream:
+        yield from iter_transcript_stream(stream, fmt)
+
+def iter_speakers(entries, speaker_a=None, speaker_b=None, stats=None):
+    # Yields the app's ('User A'|'User B', text, emotion) tuples; stats['skipped'] counts other speakers
+    names = [speaker_a, speaker_b]
+    for speaker, message, emotion in entries:
+        if speaker not in names:
+            if names[0] is None:
+                names[0] = speaker
+            elif names[1] is None and speaker != names[0]:
+                names[1] = speaker
+            else:
+                if stats is not None:
+                    stats['skipped'] = stats.get('skipped', 0) + 1
+                continue
+        yield SPEAKERS[names.index(speaker)], message, emotion
+
+def map_speakers(entries, speaker_a=None, speaker_b=None):
+    # Returns (messages, skipped) where messages use the app's ('User A'|'User B', text, emotion) tuples
+    stats = {'skipped': 0}
+    messages = list(iter_speakers(entries, speaker_a, speaker_b, stats))
+    return messages, stats['skipped']
+
+def pair_messages(messages):
+    return [messages[i:i + 2] for i in range(0, len(messages), 2)]
+
+def iter_message_pairs(messages):
+    messages = iter(messages)
+    while True:
+        pair = list(itertools.islice(messages, 2))
+        if not pair:
+            return
+        yield pair
+
+IMPORT_CHUNK_SIZE = int(os.environ.get("IMPORT_CHUNK_SIZE", "64"))
+
+def iter_classified(messages, use_model=True, chunk_size=IMPORT_CHUNK_SIZE):
+    # Fills in missing emotions one chunk at a time with a single batched detect_emotions call per chunk
+    messages = iter(messages)
+    while True:
+        chunk = list(itertools.islice(messages, chunk_size))
+        if not chunk:
+            return
+        missing = [i for i, (_, _, emotion) in enumerate(chunk) if not emotion]
+        if missing and use_model:
+            emotions = detect_emotions([chunk[i][1] for i in missing])
+        else:
+            emotions = ["neutral"] * len(missing)
+        for i, emotion in zip(missing, emotions):
+            speaker, message, _ = chunk[i]
+            chunk[i] = (speaker, message, emotion)
+        yield from chunk
+
+def stream_comic(messages, user_genders, pdf_output=None, out_dir=None, encoding='lossless', quality=85,
+                 use_model=True, executor=None, progress=None):
+    # Generator stages pulled from the end: classify in chunks -> pair -> render in order on the pool ->
+    # write PNG files and PDF pages. Each stage only reads ahead as far as the next one consumes, so
+    # memory is set by IMPORT_CHUNK_SIZE and the pool window, not by the conversation length
+    counts = {'messages': 0, 'pages': 0}
+    def counted(messages):
+        for message in messages:
+            counts['messages'] += 1
+            yield message
+    writer = StreamingPdfWriter(pdf_output, encoding, quality) if pdf_output is not None else None
+    if out_dir:
+        os.makedirs(out_dir, exist_ok=True)
+    pairs = iter_message_pairs(iter_classified(counted(messages), use_model))
+    for page_number, png in render_comic_pages(pairs, user_genders, executor=executor, encoded=True):
+        if out_dir:
+            with open(os.path.join(out_dir, f"comic_page_{page_number + 1}.png"), 'wb') as f:
+                f.write(png)
+        if writer is not None:
+            writer.add_page(png)
+        counts['pages'] += 1
+        if progress:
+            progress(counts['messages'], counts['pages'])
+    if writer is not None:
+        writer.close()
+    return counts
+
+def stream_comic_vector(messages, user_genders, pdf_output, use_model=True, progress=None):
+    # Same pipeline as stream_comic, but pages are drawn straight into a vector PDF; there is no
+    # raster page to hand to a worker pool, so it runs in-process
+    counts = {'messages': 0, 'pages': 0}
+    def counted(messages):
+        for message in messages:
+            counts['messages'] += 1
+            yield message
+    def on_page(page_count):
+        counts['pages'] = page_count
+        if progress:
+            progress(counts['messages'], page_count)
+    pairs = iter_message_pairs(iter_classified(counted(messages), use_model))
+    create_comic_pdf_vector(pairs, user_genders, output=pdf_output, progress=on_page)
+    return counts
 
 # ==========================================
-# 5. HELPER FUNCTIONS: CARD GENERATOR
+# 7. HELPER FUNCTIONS: CARD GENERATOR
 # ==========================================
 
 def get_color_scheme(occasion_type):
@@ -348,19 +2254,58 @@ def get_color_scheme(occasion_type):
             return color_schemes[key]
     return color_schemes['default']
 
-def create_gradient_background(width, height, colors):
-    image = Image.new('RGB', (width, height), colors[0])
-    draw = ImageDraw.Draw(image)
-    for i in range(height):
-        ratio = i / height
-        if len(colors) >= 2:
-            r = int(colors[0][0] * (1 - ratio) + colors[1][0] * ratio)
-            g = int(colors[0][1] * (1 - ratio) + colors[1][1] * ratio)
-            b = int(colors[0][2] * (1 - ratio) + colors[1][2] * ratio)
-            draw.line([(0, i), (width, i)], fill=(r, g, b))
-    return image
+GRADIENT_MODES = ('vertical', 'horizontal', 'diagonal', 'radial')
+GRADIENT_CACHE_SIZE = 32
+CARD_BASE_CACHE_SIZE = 32
 
-def add_decorative_elements(draw, width, height, card_type):
+def _gradient_field(width, height, mode, rows=None):
+    # Position of every pixel along the gradient, 0.0 at the first stop and 1.0 at the last;
+    # rows=(top, bottom) computes just that band of the full-size field
+    top, bottom = rows or (0, height)
+    ys = np.linspace(0.0, 1.0, height, dtype=np.float32)[top:bottom, None]
+    if mode == 'vertical':
+        return ys
+    xs = np.linspace(0.0, 1.0, width, dtype=np.float32)[None, :]
+    if mode == 'horizontal':
+        return xs
+    if mode == 'diagonal':
+        return (xs + ys) / 2.0
+    if mode == 'radial':
+        dx = (xs - 0.5) * width
+        dy = (ys - 0.5) * height
+        dist = np.sqrt(dx * dx + dy * dy)
+        # The corners are furthest from the centre
+        return dist / max(float(np.hypot(0.5 * width, 0.5 * height)), 1.0)
+    raise ValueError(f"Unknown gradient mode: {mode}")
+
+def gradient_stops(colors):
+    stops = tuple(tuple(int(v) for v in color[:3]) for color in colors)
+    return stops or ((255, 255, 255),)
+
+def render_gradient_band(width, height, stops, mode, rows=None):
+    top, bottom = rows or (0, height)
+    if len(stops) == 1:
+        return Image.new('RGB', (width, bottom - top), stops[0])
+    field = _gradient_field(width, height, mode, rows)
+    positions = np.linspace(0.0, 1.0, len(stops))
+    palette = np.array(stops, dtype=np.float32)
+    channels = [np.interp(field, positions, palette[:, c]) for c in range(3)]
+    pixels = np.broadcast_to(np.stack(channels, axis=-1), (bottom - top, width, 3))
+    return Image.fromarray(pixels.astype(np.uint8), 'RGB')
+
+@process_cache(max_entries=GRADIENT_CACHE_SIZE)
+def _render_gradient(width, height, stops, mode):
+    return render_gradient_band(width, height, stops, mode)
+
+def create_gradient_background(width, height, colors, mode='vertical'):
+    # Cached base is shared, callers draw on their own copy
+    return _render_gradient(width, height, gradient_stops(colors), mode).copy()
+
+def clear_gradient_cache():
+    _render_gradient.clear()
+
+def add_decorative_elements(draw, width, height, card_type, rng=None):
+    rng = rng or random
     for i in range(5):
         x = 30 + i * 8
         y = 30 + i * 8
@@ -372,38 +2317,55 @@ def add_decorative_elements(draw, width, height, card_type):
     draw.line([(50, height-80), (width-50, height-80)], fill=(255, 255, 255), width=3)
     if 'birthday' in card_type.lower() or 'wishes' in card_type.lower():
         for _ in range(8):
-            x = random.randint(50, width-50)
-            y = random.randint(50, height-100)
-            size = random.randint(8, 15)
+            x = rng.randint(50, width-50)
+            y = rng.randint(50, height-100)
+            size = rng.randint(8, 15)
             draw.ellipse([x-size, y-size, x+size, y+size], fill=(255, 255, 255, 150))
 
-def generate_invitation_card(data):
-    width, height = 800, 1000
-    colors = get_color_scheme(data.get('event_type', 'default'))
-    img = create_gradient_background(width, height, colors)
+def template_seed(width, height, decoration_type):
+    return zlib.crc32(f"{width}x{height}:{decoration_type.lower()}".encode('utf-8'))
+
+@process_cache(max_entries=CARD_BASE_CACHE_SIZE)
+def _render_card_base(width, height, occasion, decoration_type, gradient_mode):
+    img = create_gradient_background(width, height, get_color_scheme(occasion), gradient_mode)
     draw = ImageDraw.Draw(img, 'RGBA')
-    add_decorative_elements(draw, width, height, data.get('event_type', ''))
-    
-    try:
-        title_font = ImageFont.truetype("arial.ttf", 48)
-        subtitle_font = ImageFont.truetype("arial.ttf", 32)
-        body_font = ImageFont.truetype("arial.ttf", 24)
-        small_font = ImageFont.truetype("arial.ttf", 20)
-    except:
-        title_font = ImageFont.load_default()
-        subtitle_font = ImageFont.load_default()
-        body_font = ImageFont.load_default()
-        small_font = ImageFont.load_default()
+    add_decorative_elements(draw, width, height, decoration_type, random.Random(template_seed(width, height, decoration_type)))
+    return img
+
+def create_card_base(width, height, occasion, decoration_type, gradient_mode='vertical'):
+    # Static layer (gradient + seeded decorations) cached per template; text is drawn on a copy
+    return _render_card_base(width, height, occasion.lower(), decoration_type.lower(), gradient_mode).copy()
+
+CARD_SIZES = {'invitation': (800, 1000), 'wishes': (800, 600)}
+
+def card_template(card_type, data):
+    # (occasion, decoration type, gradient mode) that select a card's cached base layer
+    if card_type == 'invitation':
+        return data.get('event_type', 'default'), data.get('event_type', ''), data.get('gradient_mode', 'vertical')
+    return data.get('festival_name', 'default'), f"wishes {data.get('festival_name', '')}", data.get('gradient_mode', 'vertical')
+
+@instrumented()
+def generate_invitation_card(data):
+    width, height = CARD_SIZES['invitation']
+    img = create_card_base(width, height, *card_template('invitation', data))
+    draw_invitation_text(ImageDraw.Draw(img, 'RGBA'), data, width, height)
+    return img
+
+CARD_TEXT_MARGIN = 60
+CARD_TEXT_COLOR = (255, 255, 255)
+
+def draw_invitation_text(draw, data, width, height):
+    text_width = width - (CARD_TEXT_MARGIN * 2)
     
     title_text = f"{data.get('event_type', 'Event').upper()} INVITATION"
-    title_bbox = draw.textbbox((0, 0), title_text, font=title_font)
-    title_width = title_bbox[2] - title_bbox[0]
-    draw.text(((width - title_width) // 2, 100), title_text, fill=(255, 255, 255), font=title_font)
+    fit_text_line(title_text, 48, text_width, 28).draw(draw, 0, 100, CARD_TEXT_COLOR, box_width=width)
     
     event_name = data.get('event_name', 'Special Event')
-    name_bbox = draw.textbbox((0, 0), event_name, font=subtitle_font)
-    name_width = name_bbox[2] - name_bbox[0]
-    draw.text(((width - name_width) // 2, 180), event_name, fill=(255, 255, 255), font=subtitle_font)
+    fit_text_line(event_name, 32, text_width, 20).draw(draw, 0, 180, CARD_TEXT_COLOR, box_width=width)
+    
+    if data.get('receiver_name'):
+        guest_text = f"Dear {data['receiver_name']}"
+        fit_text_line(guest_text, 20, text_width, 14).draw(draw, 0, 232, CARD_TEXT_COLOR, box_width=width)
     
     y_pos = 280
     details = [
@@ -412,51 +2374,32 @@ def generate_invitation_card(data):
         f"👥 Hosted by: {data.get('host_name', 'Host')}"
     ]
     for detail in details:
-        wrapped_text = textwrap.fill(detail, width=40)
-        for line in wrapped_text.split('\n'):
-            line_bbox = draw.textbbox((0, 0), line, font=body_font)
-            line_width = line_bbox[2] - line_bbox[0]
-            draw.text(((width - line_width) // 2, y_pos), line, fill=(255, 255, 255), font=body_font)
-            y_pos += 40
+        y_pos = layout_text(detail, 24, text_width, 40).draw(draw, 0, y_pos, CARD_TEXT_COLOR, box_width=width)
         y_pos += 20
         
+    footer_y = height - 150
     if data.get('additional_notes'):
         y_pos += 40
-        notes_text = data['additional_notes']
-        wrapped_notes = textwrap.fill(notes_text, width=50)
-        for line in wrapped_notes.split('\n'):
-            line_bbox = draw.textbbox((0, 0), line, font=small_font)
-            line_width = line_bbox[2] - line_bbox[0]
-            draw.text(((width - line_width) // 2, y_pos), line, fill=(255, 255, 255), font=small_font)
-            y_pos += 30
+        notes = layout_text(data['additional_notes'], 20, text_width, 30,
+                            max_height=max(30, footer_y - 20 - y_pos), min_font_size=14)
+        notes.draw(draw, 0, y_pos, CARD_TEXT_COLOR, box_width=width)
             
     footer_text = "✨ Your presence is our present ✨"
-    footer_bbox = draw.textbbox((0, 0), footer_text, font=small_font)
-    footer_width = footer_bbox[2] - footer_bbox[0]
-    draw.text(((width - footer_width) // 2, height - 150), footer_text, fill=(255, 255, 255), font=small_font)
-    return img
+    fit_text_line(footer_text, 20, text_width, 14).draw(draw, 0, footer_y, CARD_TEXT_COLOR, box_width=width)
 
+@instrumented()
 def generate_wishes_card(data):
-    width, height = 800, 600
-    colors = get_color_scheme(data.get('festival_name', 'default'))
-    img = create_gradient_background(width, height, colors)
-    draw = ImageDraw.Draw(img, 'RGBA')
-    add_decorative_elements(draw, width, height, f"wishes {data.get('festival_name', '')}")
-    
-    try:
-        title_font = ImageFont.truetype("arial.ttf", 56)
-        subtitle_font = ImageFont.truetype("arial.ttf", 32)
-        body_font = ImageFont.truetype("arial.ttf", 24)
-    except:
-        title_font = ImageFont.load_default()
-        subtitle_font = ImageFont.load_default()
-        body_font = ImageFont.load_default()
+    width, height = CARD_SIZES['wishes']
+    img = create_card_base(width, height, *card_template('wishes', data))
+    draw_wishes_text(ImageDraw.Draw(img, 'RGBA'), data, width, height)
+    return img
+
+def draw_wishes_text(draw, data, width, height):
+    text_width = width - (CARD_TEXT_MARGIN * 2)
         
     festival_name = data.get('festival_name', 'Festival')
     greeting = f"Happy {festival_name}!"
-    greeting_bbox = draw.textbbox((0, 0), greeting, font=title_font)
-    greeting_width = greeting_bbox[2] - greeting_bbox[0]
-    draw.text(((width - greeting_width) // 2, 80), greeting, fill=(255, 255, 255), font=title_font)
+    fit_text_line(greeting, 56, text_width, 32).draw(draw, 0, 80, CARD_TEXT_COLOR, box_width=width)
     
     y_pos = 200
     if data.get('personal_message'):
@@ -471,68 +2414,818 @@ def generate_wishes_card(data):
         festival_lower = festival_name.lower()
         message = default_messages.get(festival_lower, 'Wishing you joy, happiness and wonderful celebrations!')
         
-    wrapped_message = textwrap.fill(message, width=50)
-    for line in wrapped_message.split('\n'):
-        line_bbox = draw.textbbox((0, 0), line, font=body_font)
-        line_width = line_bbox[2] - line_bbox[0]
-        draw.text(((width - line_width) // 2, y_pos), line, fill=(255, 255, 255), font=body_font)
-        y_pos += 35
+    # Leave room for the two sender lines and the receiver line below the message
+    message_height = height - 80 - 80 - 60 - 10 - y_pos
+    message_layout = layout_text(message, 24, text_width, 35, max_height=message_height, min_font_size=16)
+    y_pos = message_layout.draw(draw, 0, y_pos, CARD_TEXT_COLOR, box_width=width)
         
     y_pos += 60
     sender_text = f"With warm wishes,\n{data.get('sender_name', 'Your Friend')}"
-    for line in sender_text.split('\n'):
-        line_bbox = draw.textbbox((0, 0), line, font=subtitle_font)
-        line_width = line_bbox[2] - line_bbox[0]
-        draw.text(((width - line_width) // 2, y_pos), line, fill=(255, 255, 255), font=subtitle_font)
-        y_pos += 40
+    layout_text(sender_text, 32, text_width, 40, max_lines=2).draw(draw, 0, y_pos, CARD_TEXT_COLOR, box_width=width)
         
     if data.get('receiver_name'):
         receiver_text = f"To: {data['receiver_name']}"
-        draw.text((50, height - 80), receiver_text, fill=(255, 255, 255), font=body_font)
-    return img
+        fit_text_line(receiver_text, 24, text_width, 16).draw(draw, 50, height - 80, CARD_TEXT_COLOR, align='left')
+
+# label -> (PIL format, mime type, extension, save options)
+CARD_EXPORT_FORMATS = {
+    'PNG': ('PNG', 'image/png', 'png', {'optimize': True}),
+    'WebP': ('WEBP', 'image/webp', 'webp', {'method': 4}),
+    'JPEG': ('JPEG', 'image/jpeg', 'jpg', {'optimize': True, 'progressive': True}),
+}
+CARD_PREVIEW_WIDTH = 480
+
+def card_content_key(png):
+    # Cards come back from the render pool PNG-encoded; hashing those bytes is far cheaper than the pixels
+    return hashlib.sha1(png).hexdigest()
+
+@st.cache_resource(max_entries=64)
+@instrumented()
+def encode_card(content_key, export_format='PNG', quality=90, _png=None):
+    # Encoded once per (card content, format, quality); _png is the worker's PNG and not part of the
+    # cache key. A PNG download is that file as it is
+    if export_format == 'PNG':
+        return bytes(_png)
+    pil_format, _, _, options = CARD_EXPORT_FORMATS[export_format]
+    buffer = io.BytesIO()
+    img = Image.open(io.BytesIO(_png))
+    img = img.convert('RGB') if pil_format == 'JPEG' else img
+    if pil_format in ('JPEG', 'WEBP'):
+        options = dict(options, quality=quality)
+    img.save(buffer, format=pil_format, **options)
+    return buffer.getvalue()
+
+@st.cache_resource(max_entries=64)
+def card_preview(content_key, _png=None, width=CARD_PREVIEW_WIDTH):
+    preview = Image.open(io.BytesIO(_png))
+    preview.thumbnail((width, width * 4), Image.Resampling.LANCZOS)
+    buffer = io.BytesIO()
+    preview.convert('RGB').save(buffer, format='JPEG', quality=85)
+    return buffer.getvalue()
+
+# Guest-list columns accepted besides the card's own field names
+RECIPIENT_ALIASES = {'name': 'receiver_name', 'guest': 'receiver_name', 'recipient': 'receiver_name', 'to': 'receiver_name'}
+NOTE_FIELDS = {'invitation': 'additional_notes', 'wishes': 'personal_message'}
+
+def generate_card(card_type, data):
+    if card_type == 'invitation':
+        return generate_invitation_card(data)
+    return generate_wishes_card(data)
+
+def iter_recipients(stream, card_type):
+    for row in csv.DictReader(stream):
+        recipient = {}
+        for key, value in row.items():
+            if not key or value is None:
+                continue
+            key = key.strip().lower().replace(' ', '_')
+            if key in ('note', 'notes'):
+                key = NOTE_FIELDS[card_type]
+            recipient[RECIPIENT_ALIASES.get(key, key)] = value.strip()
+        if any(recipient.values()):
+            yield recipient
+
+def card_filename(index, recipient):
+    name = re.sub(r'[^A-Za-z0-9]+', '_', recipient.get('receiver_name', '')).strip('_') or 'card'
+    return f"{index + 1:04d}_{name}.png"
+
+def _bulk_card_task(card_type, data):
+    card = generate_card(card_type, data)
+    buffer = io.BytesIO()
+    with timed('encode_card'):
+        card.save(buffer, format='PNG', compress_level=3)
+    return buffer.getvalue()
+
+def iter_bulk_cards(card_type, base_data, recipients, executor=None):
+    # Yields (filename, png_bytes) in guest-list order; the base layer is cached per worker and
+    # only text rasterization and PNG encoding run per recipient
+    executor = executor or get_render_executor()
+    task = _renderer_module()._bulk_card_task if isinstance(executor, ProcessPoolExecutor) else _bulk_card_task
+    recipients = iter(recipients)
+    names = deque()
+    def jobs():
+        for recipient in recipients:
+            names.append(recipient)
+            yield card_type, {**base_data, **recipient}
+    for index, png in enumerate(iter_ordered_results(executor, task, jobs())):
+        yield card_filename(index, names.popleft()), png
+
+def write_cards_zip(cards, output, progress=None):
+    count = 0
+    with zipfile.ZipFile(output, 'w', compression=zipfile.ZIP_STORED) as archive:
+        for filename, png in cards:
+            archive.writestr(filename, png)
+            count += 1
+            if progress: progress(count)
+    return count
+
+def write_cards_pdf(cards, output, progress=None):
+    # Each card goes to output as soon as it is rendered, so memory does not grow with the guest list
+    writer = StreamingPdfWriter(output)
+    for _, png in cards:
+        writer.add_page(png)
+        if progress: progress(len(writer.page_ids))
+    return writer.close()
+
+CARD_TEXT_DRAWERS = {'invitation': draw_invitation_text, 'wishes': draw_wishes_text}
+CARD_PDF_SCALE = 0.75  # card pixels at 96 dpi -> PDF points
+
+@instrumented()
+def create_cards_pdf_vector(card_type, cards, output=None, progress=None):
+    # One card-sized page per data dict in cards: the base layer is embedded once per template and
+    # the text is drawn as vector text by the same functions that rasterize it
+    from reportlab.pdfgen import canvas
+    width, height = CARD_SIZES[card_type]
+    page_size = (width * CARD_PDF_SCALE, height * CARD_PDF_SCALE)
+    buffer = output if output is not None else io.BytesIO()
+    c = canvas.Canvas(buffer, pagesize=page_size)
+    readers = OrderedDict()
+    count = 0
+    for data in cards:
+        with timed('pdf_vector_card'):
+            occasion, decoration_type, gradient_mode = card_template(card_type, data)
+            draw = PdfDraw(c, (0, 0) + page_size, (width, height), readers)
+            draw.image(_render_card_base(width, height, occasion.lower(), decoration_type.lower(), gradient_mode), 0, 0)
+            CARD_TEXT_DRAWERS[card_type](draw, data, width, height)
+            c.showPage()
+        count += 1
+        if progress: progress(count)
+    if count == 0: return None
+    c.save()
+    return buffer if output is not None else buffer.getvalue()
+
+def write_cards_pdf_vector(card_type, base_data, recipients, output, progress=None):
+    counter = {'count': 0}
+    def on_card(count):
+        counter['count'] = count
+        if progress: progress(count)
+    create_cards_pdf_vector(card_type, ({**base_data, **recipient} for recipient in recipients), output, on_card)
+    return counter['count']
+
+@process_cache(max_entries=64)
+def scaled_font(path, size):
+    if path:
+        return ImageFont.truetype(path, size)
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        return ImageFont.load_default()
+
+class ScaledDraw:
+    # ImageDraw wrapper for print rendering: takes the card's logical coordinates, draws them scaled into
+    # one band of the print canvas and skips shapes and text lines that miss the band
+    def __init__(self, draw, scale, top, band_height):
+        self.draw = draw
+        self.scale = scale
+        self.top = top
+        self.bottom = top + band_height
+
+    def _xy(self, points):
+        return [(x * self.scale, y * self.scale - self.top) for x, y in points]
+
+    def _misses(self, y0, y1):
+        return y1 * self.scale < self.top or y0 * self.scale > self.bottom
+
+    def _width(self, width):
+        return max(1, round(width * self.scale)) if width else 0
+
+    def ellipse(self, xy, fill=None, outline=None, width=1):
+        x0, y0, x1, y1 = xy
+        if self._misses(y0, y1):
+            return
+        (x0, y0), (x1, y1) = self._xy([(x0, y0), (x1, y1)])
+        self.draw.ellipse([x0, y0, x1, y1], fill=fill, outline=outline, width=self._width(width))
 
-def create_download_link(img, filename):
-    buffered = io.BytesIO()
-    img.save(buffered, format="PNG")
-    img_bytes = buffered.getvalue()
-    b64 = base64.b64encode(img_bytes).decode()
-    href = f'<a href="data:image/png;base64,{b64}" download="{filename}" class="action-button">📥 Download Card</a>'
-    return href
+    def line(self, xy, fill=None, width=0):
+        ys = [y for _, y in xy]
+        if self._misses(min(ys) - width, max(ys) + width):
+            return
+        self.draw.line(self._xy(xy), fill=fill, width=self._width(width))
+
+    def text(self, xy, text, fill=None, font=None):
+        x, y = xy
+        size = getattr(font, 'size', None)
+        if size is None:
+            # Bitmap fonts cannot be scaled
+            return self.draw.text(self._xy([xy])[0], text, fill=fill, font=font)
+        if self._misses(y, y + size * 1.5):
+            return
+        path = getattr(font, 'path', None)
+        font = scaled_font(path if isinstance(path, str) else None, max(1, round(size * self.scale)))
+        self.draw.text(self._xy([xy])[0], text, fill=fill, font=font)
+
+def print_card_geometry(card_type, paper='A5', dpi=PRINT_DPI):
+    # Returns (pixel size, logical size, page size in points). The logical canvas keeps the screen card's
+    # width and takes the paper's aspect ratio, so the layout code is unchanged; landscape cards are
+    # printed on landscape paper
+    paper_width, paper_height = PRINT_PAPER_SIZES[paper]
+    logical_width, screen_height = CARD_SIZES[card_type]
+    if logical_width > screen_height:
+        paper_width, paper_height = paper_height, paper_width
+    pixel_size = (round(paper_width / 25.4 * dpi), round(paper_height / 25.4 * dpi))
+    logical_size = (logical_width, round(logical_width * paper_height / paper_width))
+    return pixel_size, logical_size, (paper_width / 25.4 * 72, paper_height / 25.4 * 72)
+
+def iter_card_bands(card_type, data, pixel_size, logical_size, supersample=PRINT_SUPERSAMPLE, band_rows=PRINT_BAND_ROWS):
+    # Yields the card top to bottom as RGB bands of band_rows rows (the last may be shorter). Each band
+    # is drawn at supersample x resolution and box-filtered down, so memory holds one band at a time
+    width, height = pixel_size
+    logical_width, logical_height = logical_size
+    factor = max(1, supersample)
+    scale = width * factor / logical_width
+    occasion, decoration_type, gradient_mode = card_template(card_type, data)
+    decoration_type = decoration_type.lower()
+    stops = gradient_stops(get_color_scheme(occasion.lower()))
+    for top in range(0, height, band_rows):
+        rows = min(band_rows, height - top)
+        with timed('print_card_band'):
+            band = render_gradient_band(width * factor, height * factor, stops, gradient_mode,
+                                        (top * factor, (top + rows) * factor))
+            draw = ScaledDraw(ImageDraw.Draw(band, 'RGBA'), scale, top * factor, rows * factor)
+            # Re-seeded per band so every band places the same decorations
+            rng = random.Random(template_seed(logical_width, logical_height, decoration_type))
+            add_decorative_elements(draw, logical_width, logical_height, decoration_type, rng)
+            CARD_TEXT_DRAWERS[card_type](draw, data, logical_width, logical_height)
+            if factor > 1:
+                band = band.reduce(factor)
+        yield band
+
+def _png_chunk(kind, data):
+    return struct.pack('>I', len(data)) + kind + data + struct.pack('>I', zlib.crc32(kind + data))
+
+def write_png_bands(output, size, bands, dpi=PRINT_DPI):
+    # Streams an 8-bit RGB PNG, deflating each band into IDAT chunks as it arrives
+    width, height = size
+    stride = width * 3
+    pixels_per_metre = round(dpi / 0.0254)
+    output.write(b'\x89PNG\r\n\x1a\n')
+    output.write(_png_chunk(b'IHDR', struct.pack('>IIBBBBB', width, height, 8, 2, 0, 0, 0)))
+    output.write(_png_chunk(b'pHYs', struct.pack('>IIB', pixels_per_metre, pixels_per_metre, 1)))
+    compressor = zlib.compressobj(6)
+    for band in bands:
+        pixels = np.asarray(band, dtype=np.uint8).reshape(band.size[1], stride)
+        # Sub filter (type 1): each byte minus the same channel one pixel to the left, which suits gradients
+        rows = np.empty((pixels.shape[0], stride + 1), dtype=np.uint8)
+        rows[:, 0] = 1
+        rows[:, 1:4] = pixels[:, :3]
+        rows[:, 4:] = pixels[:, 3:] - pixels[:, :-3]
+        data = compressor.compress(rows.tobytes())
+        if data:
+            output.write(_png_chunk(b'IDAT', data))
+    output.write(_png_chunk(b'IDAT', compressor.flush()))
+    output.write(_png_chunk(b'IEND', b''))
+
+TIFF_FORMATS = {3: 'H', 4: 'I', 5: 'I'}  # SHORT, LONG, RATIONAL (numerator, denominator pairs)
+
+def write_tiff_bands(output, size, bands, dpi=PRINT_DPI, band_rows=PRINT_BAND_ROWS):
+    # Streams an uncompressed RGB TIFF with one strip per band. Strip sizes are known up front, so the
+    # directory is written first and the strips follow as they arrive
+    width, height = size
+    strips = [min(band_rows, height - top) * width * 3 for top in range(0, height, band_rows)]
+    entries = [(256, 4, [width]), (257, 4, [height]), (258, 3, [8, 8, 8]), (259, 3, [1]), (262, 3, [2]),
+               (273, 4, [0] * len(strips)), (277, 3, [3]), (278, 4, [band_rows]), (279, 4, strips),
+               (282, 5, [dpi, 1]), (283, 5, [dpi, 1]), (296, 3, [2])]
+    payloads = [struct.pack('<' + TIFF_FORMATS[kind] * len(values), *values) for _, kind, values in entries]
+    directory_end = 8 + 2 + 12 * len(entries) + 4
+    data_start = directory_end + sum(len(payload) for payload in payloads if len(payload) > 4)
+    entries[5] = (273, 4, list(itertools.accumulate([data_start] + strips[:-1])))
+    payloads[5] = struct.pack('<' + 'I' * len(strips), *entries[5][2])
+    directory, extra = [struct.pack('<H', len(entries))], []
+    extra_offset = directory_end
+    for (tag, kind, values), payload in zip(entries, payloads):
+        count = len(values) // 2 if kind == 5 else len(values)
+        if len(payload) <= 4:
+            directory.append(struct.pack('<HHI', tag, kind, count) + payload.ljust(4, b'\0'))
+        else:
+            directory.append(struct.pack('<HHII', tag, kind, count, extra_offset))
+            extra.append(payload)
+            extra_offset += len(payload)
+    directory.append(struct.pack('<I', 0))
+    output.write(b'II*\x00' + struct.pack('<I', 8))
+    output.write(b''.join(directory + extra))
+    for band in bands:
+        output.write(band.tobytes())
+
+@instrumented()
+def render_print_card(card_type, data, output, fmt='png', paper='A5', dpi=PRINT_DPI,
+                      supersample=PRINT_SUPERSAMPLE, band_rows=PRINT_BAND_ROWS):
+    # Renders the card at print resolution straight into output as PNG, TIFF or a one-page PDF of the
+    # paper size; returns the pixel size
+    if fmt not in PRINT_FORMATS:
+        raise ValueError(f"Unknown print format: {fmt}")
+    pixel_size, logical_size, page_size = print_card_geometry(card_type, paper, dpi)
+    bands = iter_card_bands(card_type, data, pixel_size, logical_size, supersample, band_rows)
+    if fmt == 'png':
+        write_png_bands(output, pixel_size, bands, dpi)
+    elif fmt == 'tiff':
+        write_tiff_bands(output, pixel_size, bands, dpi, band_rows)
+    else:
+        writer = StreamingPdfWriter(output)
+        writer.add_image_page(pixel_size, bands, page_size)
+        writer.close()
+    return pixel_size
 
 # ==========================================
-# 6. APP MODULES
+# 8. RENDER SERVICE
 # ==========================================
 
+class RenderServiceBusy(RuntimeError):
+    pass
+
+class RenderJobTimeout(RuntimeError):
+    pass
+
+class RenderJob:
+    def __init__(self, key, kind, timeout):
+        self.id = uuid.uuid4().hex[:12]
+        self.key = key
+        self.kind = kind
+        self.timeout = timeout
+        self.state = 'queued'
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.submitted_at = time.monotonic()
+        self.started_at = None
+        self.finished_at = None
+        self.finished = threading.Event()
+
+    def remaining(self):
+        if self.started_at is None:
+            return self.timeout
+        return self.timeout - (time.monotonic() - self.started_at)
+
+    def check(self):
+        # Called between steps; a step that is already running is not interrupted
+        if self.remaining() <= 0:
+            raise RenderJobTimeout(f"{self.kind} job exceeded {self.timeout:.0f} s")
+
+    def step(self, done, total=None):
+        self.done = done
+        if total is not None:
+            self.total = total
+        self.check()
+
+    def wait(self, timeout=None):
+        # Blocks until the job has finished and returns its result, raising its error
+        if not self.finished.wait(timeout):
+            raise RenderJobTimeout(f"{self.kind} job is still {self.state}")
+        if self.state != 'done':
+            raise self.error
+        return self.result
+
+    def status(self):
+        now = time.monotonic()
+        return {
+            'id': self.id, 'kind': self.kind, 'state': self.state, 'done': self.done, 'total': self.total,
+            'queued_s': (self.started_at or now) - self.submitted_at,
+            'running_s': (self.finished_at or now) - self.started_at if self.started_at else 0.0,
+            'error': str(self.error) if self.error else None,
+        }
+
+class RenderService:
+    # In-process job API for page, PDF and card rendering. Identical jobs that are queued or running
+    # are coalesced into one. Sessions keep the RenderJob they submitted and poll it; the last `history`
+    # finished jobs of each kind also stay reachable by id. Long exports get their own threads so they
+    # never hold up a page or card someone is waiting for
+    BULK_KINDS = ('pdf',)
+
+    def __init__(self, workers=RENDER_SERVICE_JOBS, queue_size=RENDER_QUEUE_SIZE, timeout=RENDER_JOB_TIMEOUT,
+                 history=RENDER_JOB_HISTORY, executor=None):
+        self.queue_size = queue_size
+        self.timeout = timeout
+        self.history = history
+        # The render pool is created once and shut down with the service unless the caller owns it
+        self._owns_executor = executor is None
+        self.render_executor = create_render_executor() if executor is None else executor
+        self.coalesced = 0
+        self.rejected = 0
+        self._bulk = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='render-export')
+        # Page and card jobs only wait on the render pool, which caps their CPU use
+        self._interactive = ThreadPoolExecutor(max_workers=RENDER_WORKERS, thread_name_prefix='render-job')
+        self._inflight = {}
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, func, args, key=None, timeout=None):
+        key = (kind, key) if key is not None else (kind, uuid.uuid4().hex)
+        with self._lock:
+            job = self._inflight.get(key)
+            if job is not None:
+                self.coalesced += 1
+                count_event('render_job_coalesced')
+                return job
+            if len(self._inflight) >= self.queue_size:
+                self.rejected += 1
+                count_event('render_job_rejected')
+                raise RenderServiceBusy(f"Render queue is full ({self.queue_size} jobs), try again shortly")
+            job = RenderJob(key, kind, timeout or self.timeout)
+            self._inflight[key] = job
+            self._jobs[job.id] = job
+        pool = self._bulk if kind in self.BULK_KINDS else self._interactive
+        pool.submit(self._run, job, func, args)
+        return job
+
+    def _run(self, job, func, args):
+        job.started_at = time.monotonic()
+        job.state = 'running'
+        try:
+            with timed(f"job_{job.kind}"):
+                job.result = func(job, *args)
+            job.state = 'done'
+        except RenderJobTimeout as e:
+            job.state, job.error = 'timeout', e
+            count_event('render_job_timeout')
+        except Exception as e:
+            job.state, job.error = 'failed', e
+        finally:
+            job.finished_at = time.monotonic()
+            with self._lock:
+                self._inflight.pop(job.key, None)
+                # Per kind, so a burst of page renders does not push the PDF and card jobs out
+                finished = [j for j in self._jobs.values() if j.kind == job.kind and j.finished_at is not None]
+                for old in finished[:max(0, len(finished) - self.history)]:
+                    del self._jobs[old.id]
+            job.finished.set()
+
+    def job(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _pool_result(self, job, task, *args):
+        # Runs one task on the render pool, giving up when the job runs out of time
+        if isinstance(self.render_executor, ProcessPoolExecutor):
+            task = getattr(_renderer_module(), task.__name__)
+        future = self.render_executor.submit(task, *args)
+        try:
+            return future.result(timeout=max(0.0, job.remaining()))
+        except FuturesTimeout:
+            future.cancel()
+            raise RenderJobTimeout(f"{job.kind} job exceeded {job.timeout:.0f} s") from None
+
+    def render_page(self, message_pair, page_number, user_genders):
+        key = page_cache_key(message_pair, page_number, user_genders)
+        return self.submit('page', self._page_job, (message_pair, page_number, user_genders), key=key)
+
+    def _page_job(self, job, message_pair, page_number, user_genders):
+        job.step(0, 1)
+        return self._pool_result(job, _render_page_png_task, message_pair, page_number, user_genders)
+
+    def render_comic_pdf(self, pages, encoding='lossless', quality=85):
+        # pages is a PageStore; the pages present now are exported even if more are added meanwhile
+        count = len(pages)
+        key = (pages.content_key(count), encoding, quality)
+        return self.submit('pdf', self._pdf_job, (pages, count, encoding, quality), key=key)
+
+    def _pdf_job(self, job, pages, count, encoding, quality):
+        def steps():
+            for index, png in enumerate(pages.iter_png(count)):
+                job.step(index, count)
+                yield png
+            job.step(count)
+        pdf_data = create_comic_pdf(steps(), encoding=encoding, quality=quality)
+        job.check()
+        if pdf_data is None:
+            raise RuntimeError("Failed to create PDF")
+        return pdf_data
+
+    def render_comic_pdf_vector(self, messages, user_genders):
+        # Vector pages are drawn from the messages rather than the rendered pages
+        message_pairs = [pair for pair in pair_messages(list(messages)) if len(pair) == 2]
+        key = hashlib.sha256(json.dumps(['vector', message_pairs, user_genders], sort_keys=True).encode('utf-8')).hexdigest()
+        return self.submit('pdf', self._pdf_vector_job, (message_pairs, dict(user_genders)), key=key)
+
+    def _pdf_vector_job(self, job, message_pairs, user_genders):
+        job.step(0, len(message_pairs))
+        pdf_data = create_comic_pdf_vector(message_pairs, user_genders, progress=job.step)
+        if pdf_data is None:
+            raise RuntimeError("Failed to create PDF")
+        return pdf_data
+
+    def render_card(self, card_type, data):
+        key = hashlib.sha256(json.dumps([card_type, data], sort_keys=True).encode('utf-8')).hexdigest()
+        return self.submit('card', self._card_job, (card_type, dict(data)), key=key)
+
+    def _card_job(self, job, card_type, data):
+        job.step(0, 1)
+        return self._pool_result(job, _bulk_card_task, card_type, data)
+
+    def stats(self):
+        with self._lock:
+            states = [job.state for job in self._jobs.values()]
+            return {
+                'queued': states.count('queued'), 'running': states.count('running'),
+                'finished': sum(state not in ('queued', 'running') for state in states),
+                'coalesced': self.coalesced, 'rejected': self.rejected, 'queue_size': self.queue_size,
+            }
+
+    def shutdown(self, wait=True):
+        self._bulk.shutdown(wait=wait)
+        self._interactive.shutdown(wait=wait)
+        if self._owns_executor:
+            self.render_executor.shutdown(wait=wait)
+
+@st.cache_resource
+def get_render_service():
+    return RenderService(executor=get_render_executor())
+
+# ==========================================
+# 9. APP MODULES
+# ==========================================
+
+def rebuild_comic_pages():
+    message_pairs = [pair for pair in pair_messages(st.session_state.messages) if len(pair) == 2]
+    pages = st.session_state.comic_pages
+    pages.clear()
+    st.session_state.pending_pages.clear()
+    st.session_state.deferred_pages.clear()
+    st.session_state.page_sent_at.clear()
+    if message_pairs:
+        progress = st.progress(0.0, text="Rendering comic pages...")
+        for page_number, page in render_comic_pages(message_pairs, st.session_state.user_genders, encoded=True):
+            pages.append(page)
+            progress.progress(len(pages) / len(message_pairs), text=f"Rendered page {page_number + 1} of {len(message_pairs)}")
+        progress.empty()
+    st.session_state.rendered_genders = dict(st.session_state.user_genders)
+
+def _zoom_page(index):
+    st.session_state.zoomed_page = index
+
+def show_comic_gallery(pages):
+    # Only one gallery page of thumbnails is sent per rerun; a full-size page is sent when asked for
+    count = len(pages)
+    zoomed = st.session_state.zoomed_page
+    if zoomed is not None and zoomed < count:
+        st.image(pages.png(zoomed), caption=f"Page {zoomed + 1}", use_container_width=True)
+        st.button("✖️ Close full size", on_click=_zoom_page, args=(None,))
+
+    gallery_pages = (count + GALLERY_PAGE_SIZE - 1) // GALLERY_PAGE_SIZE
+    gallery_page = gallery_pages
+    if gallery_pages > 1:
+        # The label changes with the page count, so the gallery jumps to the newest pages when one is added
+        gallery_page = st.number_input(f"Gallery page (of {gallery_pages})", 1, gallery_pages, value=gallery_pages)
+    first = (gallery_page - 1) * GALLERY_PAGE_SIZE
+    columns = st.columns(2)
+    for i in range(first, min(first + GALLERY_PAGE_SIZE, count)):
+        with columns[(i - first) % 2]:
+            st.image(pages.thumbnail(i), caption=f"Page {i+1}", use_container_width=True)
+            st.button("🔍 Full size", key=f"zoom_page_{i}", on_click=_zoom_page, args=(i,))
+
+def queue_page_render(page_number):
+    # The page is added to (or replaced in) the page store by apply_background_results once rendered
+    message_pair = st.session_state.messages[page_number * 2:page_number * 2 + 2]
+    st.session_state.deferred_pages.pop(page_number, None)
+    try:
+        job = get_render_service().render_page(message_pair, page_number, st.session_state.user_genders)
+    except RenderServiceBusy as e:
+        # The page stays missing, so it is re-rendered with the others on the next rerun
+        st.error(f"Could not render page {page_number + 1}: {e}")
+        return
+    st.session_state.pending_pages[page_number] = job
+
+def _page_is_complete(index):
+    return index // 2 * 2 + 1 < len(st.session_state.messages)
+
+def send_message(speaker, text, manual_emotion, emotion_detection):
+    # Returns at once: detection and the page render finish in the background
+    sent_at = time.perf_counter()
+    messages = st.session_state.messages
+    index = len(messages)
+    if manual_emotion != "auto":
+        emotion = manual_emotion
+    elif emotion_detection:
+        emotion = PROVISIONAL_EMOTION
+        st.session_state.pending_emotions[index] = (get_emotion_batcher().submit(text), text)
+    else:
+        emotion = "neutral"
+    messages.append((speaker, text, emotion))
+    if len(messages) % 2 == 0:
+        page_number = len(messages) // 2 - 1
+        st.session_state.page_sent_at[page_number] = sent_at
+        if index - 1 in st.session_state.pending_emotions or index in st.session_state.pending_emotions:
+            # Drawn by apply_background_results once the emotions are in, so a fast detection costs one render
+            st.session_state.deferred_pages[page_number] = sent_at
+        else:
+            queue_page_render(page_number)
+    save_conversation(st.session_state.conversation_id, messages, st.session_state.user_genders)
+
+def set_message_emotion(index, emotion):
+    # A manual choice cancels the pending detection, so a late result cannot overwrite it
+    st.session_state.pending_emotions.pop(index, None)
+    speaker, text, _ = st.session_state.messages[index]
+    st.session_state.messages[index] = (speaker, text, emotion)
+    if _page_is_complete(index):
+        queue_page_render(index // 2)
+    save_conversation(st.session_state.conversation_id, st.session_state.messages, st.session_state.user_genders)
+
+def apply_background_results():
+    # Applies finished emotion detections and page renders; returns True while any are outstanding
+    messages = st.session_state.messages
+    pending_emotions = st.session_state.pending_emotions
+    changed_pages = set()
+    for index, (future, text) in list(pending_emotions.items()):
+        if not future.done():
+            continue
+        del pending_emotions[index]
+        if index >= len(messages) or messages[index][1] != text:
+            continue
+        try:
+            emotion = future.result()
+        except Exception as e:
+            st.warning(f"Emotion detection failed: {e}")
+            continue
+        speaker, _, provisional = messages[index]
+        if emotion != provisional:
+            messages[index] = (speaker, text, emotion)
+            if _page_is_complete(index):
+                changed_pages.add(index // 2)
+    deferred_pages = st.session_state.deferred_pages
+    now = time.perf_counter()
+    for page_number, deferred_at in list(deferred_pages.items()):
+        waiting = page_number * 2 in pending_emotions or page_number * 2 + 1 in pending_emotions
+        if not waiting or now - deferred_at >= PROVISIONAL_RENDER_AFTER_MS / 1000:
+            changed_pages.add(page_number)
+    for page_number in sorted(changed_pages):
+        queue_page_render(page_number)
+    if changed_pages:
+        save_conversation(st.session_state.conversation_id, messages, st.session_state.user_genders)
+
+    pages = st.session_state.comic_pages
+    pending_pages = st.session_state.pending_pages
+    for page_number in sorted(pending_pages):
+        job = pending_pages[page_number]
+        if job.state in ('failed', 'timeout'):
+            del pending_pages[page_number]
+            st.error(f"Could not render page {page_number + 1}: {job.error}")
+            continue
+        if job.state != 'done':
+            continue
+        if page_number < len(pages):
+            pages.set(page_number, job.result)
+        elif page_number == len(pages):
+            pages.append(job.result)
+        else:
+            # An earlier page is still rendering; pages are only appended in order
+            continue
+        del pending_pages[page_number]
+        sent_at = st.session_state.page_sent_at.pop(page_number, None)
+        if sent_at is not None:
+            # The page is shown by this rerun
+            record_startup_metric('first_message_s', time.perf_counter() - sent_at)
+            record_startup_metric('last_message_s', time.perf_counter() - sent_at, first_only=False)
+    if pending_pages and min(pending_pages) > len(pages) and len(pages) not in deferred_pages:
+        # An earlier page failed; drop the rest so the missing pages are rebuilt together
+        pending_pages.clear()
+    return bool(pending_emotions or pending_pages or deferred_pages)
+
+def show_pdf_job(job):
+    # Returns True while the export is still queued or running, so the caller keeps polling
+    if job is None:
+        return False
+    status = job.status()
+    if status['state'] == 'queued':
+        st.info(f"PDF export queued for {status['queued_s']:.0f} s...")
+    elif status['state'] == 'running':
+        st.progress(status['done'] / max(1, status['total']), text=f"Creating PDF comic: page {status['done']} of {status['total']}")
+    elif status['state'] == 'done':
+        st.download_button(label="📚 Download Comic PDF", data=job.result, file_name="chat2comic.pdf", mime="application/pdf")
+        st.success("PDF comic ready!")
+    elif status['state'] == 'timeout':
+        st.error(f"PDF export timed out: {status['error']}")
+    else:
+        st.error(f"Failed to create PDF: {status['error']}")
+    return status['state'] in ('queued', 'running')
+
 def run_chat_to_comic():
     st.title("🗨️ Chat2Comic - Turn Conversations into Comics!")
     st.markdown("Create comic pages from your conversations with background scenes and proper positioning!")
+    poll = apply_background_results()
     
     # Sidebar for configuration
     with st.sidebar:
         st.header("⚙️ Configuration")
-        st.subheader("📁 Configured Paths")
-        with st.expander("Character Images"):
-            for key, path in CHARACTER_IMAGES.items():
-                status = "✅" if os.path.exists(path) else "❌"
-                st.text(f"{status} {key}")
+        pack = get_asset_pack()
+        if pack is not None:
+            # Listed from the pack index, without touching the filesystem
+            st.subheader("📦 Asset Pack")
+            with st.expander("Character Images"):
+                for key, entry in sorted(pack.index['characters'].items()):
+                    st.text(f"✅ {key} ({entry['source']})")
+            with st.expander("Background Images"):
+                for i, entry in enumerate(pack.index['backgrounds']):
+                    st.text(f"✅ Background {i+1} ({entry['source']})")
+        else:
+            st.subheader("📁 Configured Paths")
+            with st.expander("Character Images"):
+                for key, path in CHARACTER_IMAGES.items():
+                    status = "✅" if os.path.exists(path) else "❌"
+                    st.text(f"{status} {key}")
+            
+            with st.expander("Background Images"):
+                for i, path in enumerate(BACKGROUND_IMAGES):
+                    status = "✅" if os.path.exists(path) else "❌"
+                    st.text(f"{status} Background {i+1}")
+
+        with st.expander("⏱️ Startup & Latency"):
+            metrics = get_startup_metrics()
+            labels = {
+                'cold_start_s': "First page load", 'model_load_s': "Emotion model load",
+                'first_emotion_s': "First emotion detection", 'first_message_s': "First page (send → shown)",
+                'last_message_s': "Last page (send → shown)", 'last_rerun_s': "Last rerun",
+            }
+            for name, label in labels.items():
+                value = metrics.get(name)
+                st.text(f"{label}: {value:.2f} s" if value is not None else f"{label}: –")
+            st.text("Emotion model: " + ("loaded" if 'model_load_s' in metrics else "not loaded yet") + f" ({EMOTION_BACKEND})")
+
+        with st.expander("🧠 Emotion Batching"):
+            stats = get_emotion_batcher().stats()
+            st.text(f"Queue depth: {stats['depth']}  (max {stats['max_depth']})")
+            st.text(f"Batches: {stats['batches']}  Texts: {stats['texts']}")
+            st.text(f"Batch size: mean {stats['mean_batch']:.1f}  largest {stats['largest_batch']} / {stats['max_batch']}")
+            st.text(f"Max wait: {stats['max_wait_ms']:.0f} ms (see emotion_queue_wait in Stage Metrics)")
+
+        with st.expander("📊 Stage Metrics"):
+            metrics = get_metrics()
+            snapshot = metrics.snapshot()
+            if not snapshot['stages']:
+                st.caption("Nothing measured yet.")
+            for stage, values in sorted(snapshot['stages'].items(), key=lambda item: -item[1]['total_s']):
+                st.text(f"{stage}: {values['count']}× p50 ≤{values['p50_ms']:.0f} ms  p95 ≤{values['p95_ms']:.0f} ms  "
+                        f"max {values['max_ms']:.0f} ms" + (f"  errors {values['errors']}" if values['errors'] else ""))
+            for name, value in sorted(snapshot['counters'].items()):
+                st.text(f"{name}: {value}")
+            st.caption(f"Process {snapshot['pid']}; pages rendered in pool workers are counted there.")
+            st.download_button("Prometheus text", metrics.prometheus_text(), file_name="chat2comic_metrics.prom", mime="text/plain")
+            st.download_button("JSON", json.dumps(snapshot, indent=2), file_name="chat2comic_metrics.json", mime="application/json")
+            if st.button("Reset metrics"):
+                metrics.reset()
+                st.rerun()
+
+        with st.expander("Asset Cache"):
+            stats = get_asset_cache().stats()
+            st.text(f"Hits: {stats['hits']}  Misses: {stats['misses']}  Evictions: {stats['evictions']}")
+            st.text(f"Entries: {stats['entries']}  Memory: {stats['used_bytes'] / 1e6:.1f} / {stats['budget_bytes'] / 1e6:.0f} MB")
         
-        with st.expander("Background Images"):
-            for i, path in enumerate(BACKGROUND_IMAGES):
-                status = "✅" if os.path.exists(path) else "❌"
-                st.text(f"{status} Background {i+1}")
+        st.divider()
+        with st.expander("Render Cache"):
+            render_cache = get_render_cache()
+            if render_cache is None:
+                st.text("Disabled")
+            else:
+                stats = render_cache.stats()
+                st.text(f"Hits: {stats['hits']}  Misses: {stats['misses']}  Evictions: {stats['evictions']}")
+                st.text(f"Pages: {stats['entries']}  Disk: {stats['used_bytes'] / 1e6:.1f} / {stats['budget_bytes'] / 1e6:.0f} MB")
+
+        with st.expander("Render Service"):
+            stats = get_render_service().stats()
+            st.text(f"Queued: {stats['queued']}  Running: {stats['running']}  Limit: {stats['queue_size']}")
+            st.text(f"Coalesced: {stats['coalesced']}  Rejected: {stats['rejected']}  Recent finished: {stats['finished']}")
+
+        with st.expander("Page Store"):
+            stats = st.session_state.comic_pages.stats()
+            st.text(f"This session: {stats['pages']} pages, {stats['spilled']} on disk, {stats['decoded']} decoded, {stats['thumbnails']} thumbnails")
+            st.text(f"Memory: {stats['used_bytes'] / 1e6:.1f} / {stats['budget_bytes'] / 1e6:.0f} MB  Disk: {stats['disk_bytes'] / 1e6:.1f} MB")
+            stats = get_page_budget().stats()
+            st.text(f"All sessions: {stats['sessions']} sessions, {stats['pages']} pages")
+            st.text(f"Memory: {stats['used_bytes'] / 1e6:.1f} / {stats['budget_bytes'] / 1e6:.0f} MB  Disk: {stats['disk_bytes'] / 1e6:.1f} MB")
         
         st.divider()
         st.subheader("👥 Character Genders")
-        user_a_gender = st.selectbox("User A Gender:", ["male", "female"], index=0)
-        user_b_gender = st.selectbox("User B Gender:", ["male", "female"], index=1)
+        genders = ["male", "female"]
+        user_a_gender = st.selectbox("User A Gender:", genders, index=genders.index(st.session_state.user_genders['User A']))
+        user_b_gender = st.selectbox("User B Gender:", genders, index=genders.index(st.session_state.user_genders['User B']))
         
         st.session_state.user_genders = {'User A': user_a_gender, 'User B': user_b_gender}
+        # Re-render when genders change or pages are missing after a reload; unchanged pages come from the render cache
+        expected_pages = len(st.session_state.messages) // 2
+        if (st.session_state.rendered_genders != st.session_state.user_genders
+                or (len(st.session_state.comic_pages) != expected_pages and not st.session_state.pending_pages
+                    and not st.session_state.deferred_pages)):
+            rebuild_comic_pages()
+            save_conversation(st.session_state.conversation_id, st.session_state.messages, st.session_state.user_genders)
+        if st.session_state.comic_pages and st.button("🔁 Rebuild Comic", help="Re-render all pages, e.g. after replacing image files"):
+            rebuild_comic_pages()
+            st.rerun()
         st.divider()
         emotion_detection = st.toggle("🧠 Enable Emotion Detection", value=True, help="Automatically detect emotions from text")
+        if emotion_detection and _emotion_detector_override is None:
+            warm_emotion_detector()
+        if emotion_detection:
+            for message in list(get_emotion_errors().values()):
+                st.warning(message)
         
         if st.button("🗑️ Clear Conversation", type="secondary"):
             st.session_state.messages = []
-            st.session_state.comic_pages = []
+            st.session_state.comic_pages.clear()
+            st.session_state.zoomed_page = None
+            st.session_state.pdf_job = None
+            st.session_state.pending_emotions.clear()
+            st.session_state.pending_pages.clear()
+            st.session_state.deferred_pages.clear()
+            st.session_state.page_sent_at.clear()
+            save_conversation(st.session_state.conversation_id, [], st.session_state.user_genders)
             st.rerun()
 
     col1, col2 = st.columns([1, 1])
@@ -540,7 +3233,14 @@ def run_chat_to_comic():
         st.subheader("💬 Conversation")
         for i, (speaker, message, emotion) in enumerate(st.session_state.messages):
             with st.chat_message(speaker.lower().replace(' ', '_')):
-                st.write(f"**{speaker}** *(emotion: {emotion})*")
+                if i in st.session_state.pending_emotions:
+                    st.write(f"**{speaker}** *(emotion: detecting...)*")
+                    choice = st.selectbox(f"Emotion of message {i+1}", ("auto",) + EMOTION_LABELS, label_visibility="collapsed")
+                    if choice != "auto":
+                        set_message_emotion(i, choice)
+                        st.rerun()
+                else:
+                    st.write(f"**{speaker}** *(emotion: {emotion})*")
                 st.write(message)
         
         with st.form("user_a_form"):
@@ -548,70 +3248,50 @@ def run_chat_to_comic():
             message_a = st.text_area("Message:", key="msg_a", height=100)
             col_a1, col_a2 = st.columns(2)
             with col_a1: submit_a = st.form_submit_button("Send as User A", type="primary")
-            with col_a2: manual_emotion_a = st.selectbox("Manual emotion:", ["auto", "joy", "sadness", "anger", "fear", "surprise", "disgust", "neutral"], key="emotion_a")
+            with col_a2: manual_emotion_a = st.selectbox("Manual emotion:", ("auto",) + EMOTION_LABELS, key="emotion_a")
         
         with st.form("user_b_form"):
             st.write("**User B** ({}):".format(user_b_gender.title()))
             message_b = st.text_area("Message:", key="msg_b", height=100)
             col_b1, col_b2 = st.columns(2)
             with col_b1: submit_b = st.form_submit_button("Send as User B", type="primary")
-            with col_b2: manual_emotion_b = st.selectbox("Manual emotion:", ["auto", "joy", "sadness", "anger", "fear", "surprise", "disgust", "neutral"], key="emotion_b")
+            with col_b2: manual_emotion_b = st.selectbox("Manual emotion:", ("auto",) + EMOTION_LABELS, key="emotion_b")
 
     with col2:
         st.subheader("🎨 Comic Pages")
         if submit_a and message_a.strip():
-            if manual_emotion_a != "auto": emotion = manual_emotion_a
-            elif emotion_detection: emotion = detect_emotion(message_a)
-            else: emotion = "neutral"
-            
-            st.session_state.messages.append(("User A", message_a, emotion))
-            if len(st.session_state.messages) % 2 == 0:
-                message_pair = st.session_state.messages[-2:]
-                page_number = len(st.session_state.comic_pages)
-                with st.spinner("Creating comic page..."):
-                    comic_page = create_comic_page(message_pair, page_number, st.session_state.user_genders)
-                    st.session_state.comic_pages.append(comic_page)
+            send_message("User A", message_a, manual_emotion_a, emotion_detection)
             st.rerun()
         
         if submit_b and message_b.strip():
-            if manual_emotion_b != "auto": emotion = manual_emotion_b
-            elif emotion_detection: emotion = detect_emotion(message_b)
-            else: emotion = "neutral"
-            
-            st.session_state.messages.append(("User B", message_b, emotion))
-            if len(st.session_state.messages) % 2 == 0:
-                message_pair = st.session_state.messages[-2:]
-                page_number = len(st.session_state.comic_pages)
-                with st.spinner("Creating comic page..."):
-                    comic_page = create_comic_page(message_pair, page_number, st.session_state.user_genders)
-                    st.session_state.comic_pages.append(comic_page)
+            send_message("User B", message_b, manual_emotion_b, emotion_detection)
             st.rerun()
         
         if st.session_state.comic_pages:
-            for i, page in enumerate(st.session_state.comic_pages):
-                st.image(page, caption=f"Page {i+1}", use_container_width=True)
+            pages = st.session_state.comic_pages
+            show_comic_gallery(pages)
             
             st.subheader("📥 Download Comic")
             col_d1, col_d2 = st.columns(2)
             with col_d1:
+                pdf_quality = st.radio("PDF quality:", ["Lossless (PNG)", "Compact (JPEG)", "Vector text"], horizontal=True,
+                                       help="Vector text embeds each image once and keeps bubbles and text sharp when printed")
                 if st.button("📖 Generate PDF Comic", type="primary"):
-                    with st.spinner("Creating PDF comic..."):
-                        try:
-                            pdf_path = create_comic_pdf(st.session_state.comic_pages)
-                            if pdf_path and os.path.exists(pdf_path):
-                                with open(pdf_path, 'rb') as pdf_file: pdf_data = pdf_file.read()
-                                st.download_button(label="📚 Download Comic PDF", data=pdf_data, file_name="chat2comic.pdf", mime="application/pdf")
-                                try: os.unlink(pdf_path)
-                                except: pass
-                                st.success("PDF comic ready!")
-                            else: st.error("Failed to create PDF.")
-                        except Exception as e: st.error(f"Error: {e}")
+                    encoding = 'jpeg' if pdf_quality.startswith("Compact") else 'lossless'
+                    try:
+                        service = get_render_service()
+                        if pdf_quality.startswith("Vector"):
+                            job = service.render_comic_pdf_vector(st.session_state.messages, st.session_state.user_genders)
+                        else:
+                            job = service.render_comic_pdf(pages, encoding=encoding)
+                        st.session_state.pdf_job = job
+                    except RenderServiceBusy as e:
+                        st.warning(str(e))
+                poll = show_pdf_job(st.session_state.pdf_job) or poll
             with col_d2:
                 if st.button("🖼️ Download Pages as PNG"):
-                    for i, page in enumerate(st.session_state.comic_pages):
-                        img_buffer = io.BytesIO()
-                        page.save(img_buffer, format='PNG')
-                        st.download_button(label=f"Page {i+1}", data=img_buffer.getvalue(), file_name=f"comic_page_{i+1}.png", mime="image/png", key=f"download_page_{i}")
+                    for i in range(len(pages)):
+                        st.download_button(label=f"Page {i+1}", data=pages.png(i), file_name=f"comic_page_{i+1}.png", mime="image/png", key=f"download_page_{i}")
             
             if len(st.session_state.messages) % 2 == 1:
                 st.info("💬 Send one more message to complete the current page!")
@@ -624,6 +3304,38 @@ def run_chat_to_comic():
         **Logic:** Every 2 messages = 1 comic page. User A on Left, User B on Right.
         """)
 
+    with st.expander("📜 Import a Long Conversation"):
+        st.markdown("Render a whole chat export (JSON, CSV or WhatsApp `.txt`) straight to a PDF comic. "
+                    "Messages are streamed through emotion detection, rendering and the PDF, so thousands "
+                    "of messages work without being added to the chat above.")
+        transcript = st.file_uploader("Chat export", type=["json", "csv", "txt"], key="transcript_upload")
+        if transcript and st.button("📚 Render to PDF"):
+            fmt = detect_transcript_format(transcript.name)
+            stream = io.TextIOWrapper(transcript, encoding='utf-8-sig', newline='' if fmt == 'csv' else None)
+            progress = st.progress(0.0, text="Reading conversation...")
+            on_page = lambda messages, pages: progress.progress(
+                min(1.0, transcript.tell() / max(1, transcript.size)), text=f"{pages} pages rendered from {messages} messages")
+            stats = {'skipped': 0}
+            messages = iter_speakers(iter_transcript_stream(stream, fmt), stats=stats)
+            # Pages go to disk as they render; only the finished PDF is read back for the download
+            with tempfile.TemporaryFile() as output:
+                counts = stream_comic(messages, st.session_state.user_genders, pdf_output=output,
+                                      use_model=emotion_detection, progress=on_page)
+                progress.progress(1.0, text=f"{counts['pages']} pages rendered from {counts['messages']} messages")
+                if stats['skipped']:
+                    st.warning(f"Skipped {stats['skipped']} messages from speakers other than the first two.")
+                output.seek(0)
+                if counts['pages']:
+                    st.download_button(f"📥 Download {counts['pages']}-page Comic", data=output.read(),
+                                       file_name="chat2comic_import.pdf", mime="application/pdf")
+                else:
+                    st.warning("No messages found in the uploaded file.")
+
+    # Any widget interaction interrupts the sleep, so the UI stays responsive while a job runs
+    if poll:
+        time.sleep(RENDER_POLL_INTERVAL)
+        st.rerun()
+
 def run_card_generator():
     # CSS injection specific to card generator
     st.markdown("""
@@ -698,11 +3410,13 @@ def run_card_generator():
             venue = st.text_input("Venue", placeholder="e.g., 123 Main Street, City")
             host_name = st.text_input("Host Name(s)", placeholder="e.g., John & Jane Doe")
             additional_notes = st.text_area("Additional Notes (Optional)")
+            gradient_mode = st.selectbox("Background Style", GRADIENT_MODES, format_func=str.title)
             if st.form_submit_button("🎨 Generate Invitation Card"):
                 st.session_state.card_data = {
                     'event_type': event_type, 'event_name': event_name,
                     'date_time': date_time, 'venue': venue,
-                    'host_name': host_name, 'additional_notes': additional_notes
+                    'host_name': host_name, 'additional_notes': additional_notes,
+                    'gradient_mode': gradient_mode
                 }
                 st.session_state.current_step = 'generate_card'
                 st.rerun()
@@ -717,10 +3431,12 @@ def run_card_generator():
             sender_name = st.text_input("Your Name", placeholder="e.g., John Doe")
             receiver_name = st.text_input("Receiver's Name (Optional)", placeholder="e.g., Dear Friends")
             personal_message = st.text_area("Personal Message (Optional)")
+            gradient_mode = st.selectbox("Background Style", GRADIENT_MODES, format_func=str.title)
             if st.form_submit_button("🎨 Generate Wishes Card"):
                 st.session_state.card_data = {
                     'festival_name': festival_name, 'sender_name': sender_name,
-                    'receiver_name': receiver_name, 'personal_message': personal_message
+                    'receiver_name': receiver_name, 'personal_message': personal_message,
+                    'gradient_mode': gradient_mode
                 }
                 st.session_state.current_step = 'generate_card'
                 st.rerun()
@@ -729,11 +3445,10 @@ def run_card_generator():
     elif st.session_state.current_step == 'generate_card':
         with st.spinner('🎨 Creating your beautiful card...'):
             try:
-                if st.session_state.card_type == 'invitation':
-                    card_img = generate_invitation_card(st.session_state.card_data)
-                else:
-                    card_img = generate_wishes_card(st.session_state.card_data)
-                st.session_state.generated_card = card_img
+                card_png = get_render_service().render_card(st.session_state.card_type, st.session_state.card_data).wait()
+                st.session_state.generated_card = card_png
+                st.session_state.generated_card_key = card_content_key(card_png)
+                st.session_state.generated_card_name = f"card_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
                 st.session_state.current_step = 'show_card'
                 st.rerun()
             except Exception as e:
@@ -742,10 +3457,20 @@ def run_card_generator():
     elif st.session_state.current_step == 'show_card':
         st.markdown("### 🎉 Your Beautiful Card is Ready!")
         if st.session_state.generated_card:
-            st.image(st.session_state.generated_card, caption="Your Generated Card", use_container_width=True)
-            filename = f"card_{datetime.now().strftime('%Y%m%d_%H%M%S')}.png"
-            download_link = create_download_link(st.session_state.generated_card, filename)
-            st.markdown(download_link, unsafe_allow_html=True)
+            card_png = st.session_state.generated_card
+            card_key = st.session_state.generated_card_key
+            st.image(card_preview(card_key, _png=card_png), caption="Your Generated Card", use_container_width=True)
+            col_f1, col_f2 = st.columns(2)
+            with col_f1: export_format = st.selectbox("Format", list(CARD_EXPORT_FORMATS), help="PNG is lossless; WebP and JPEG are much smaller")
+            with col_f2: quality = st.slider("Quality", 50, 100, 90, disabled=export_format == 'PNG')
+            _, mime, extension, _ = CARD_EXPORT_FORMATS[export_format]
+            card_bytes = encode_card(card_key, export_format, quality, _png=card_png)
+            st.download_button(f"📥 Download Card ({len(card_bytes) / 1024:.0f} KB)", data=card_bytes,
+                               file_name=f"{st.session_state.generated_card_name}.{extension}", mime=mime, type="primary")
+            if st.button("📄 Prepare PDF (vector text)"):
+                card_pdf = create_cards_pdf_vector(st.session_state.card_type, [st.session_state.card_data])
+                st.download_button(f"📥 Download PDF ({len(card_pdf) / 1024:.0f} KB)", data=card_pdf,
+                                   file_name=f"{st.session_state.generated_card_name}.pdf", mime="application/pdf")
             
             col1, col2 = st.columns(2)
             with col1:
@@ -759,10 +3484,55 @@ def run_card_generator():
                     st.session_state.current_step = 'collect_invitation_data' if st.session_state.card_type == 'invitation' else 'collect_wishes_data'
                     st.rerun()
 
+            with st.expander("🖨️ Print-Ready File"):
+                st.markdown("Renders the card at print resolution in bands, so large sizes never need the whole image in memory.")
+                col_p1, col_p2, col_p3 = st.columns(3)
+                with col_p1: paper = st.selectbox("Paper", list(PRINT_PAPER_SIZES))
+                with col_p2: dpi = st.select_slider("DPI", [150, 300, 600], value=PRINT_DPI if PRINT_DPI in (150, 300, 600) else 300)
+                with col_p3: print_format = st.selectbox("File", PRINT_FORMATS, format_func=str.upper)
+                if st.button("🖨️ Render for Print"):
+                    with st.spinner("Rendering print file..."), tempfile.TemporaryFile() as output:
+                        width, height = render_print_card(st.session_state.card_type, st.session_state.card_data, output,
+                                                          print_format, paper, dpi)
+                        output.seek(0)
+                        mime = {'png': 'image/png', 'tiff': 'image/tiff', 'pdf': 'application/pdf'}[print_format]
+                        st.download_button(f"📥 Download {width}x{height} {print_format.upper()}", data=output.read(),
+                                           file_name=f"{st.session_state.generated_card_name}_{paper}_{dpi}dpi.{'tif' if print_format == 'tiff' else print_format}",
+                                           mime=mime)
+
+            with st.expander("📬 Personalize for a Guest List"):
+                st.markdown("Upload a CSV with a `name` column (plus optional `notes` or any card field) to get one card per guest.")
+                guest_file = st.file_uploader("Guest list (CSV)", type=["csv"], key="guest_list")
+                bulk_format = st.radio("Output:", ["ZIP of PNGs", "Multi-page PDF", "Multi-page PDF (vector text)"], horizontal=True)
+                if guest_file and st.button("🎨 Generate All Cards"):
+                    progress = st.progress(0.0, text="Generating cards...")
+                    guests = list(iter_recipients(io.StringIO(guest_file.getvalue().decode('utf-8-sig')), st.session_state.card_type))
+                    with tempfile.TemporaryFile() as output:
+                        on_card = lambda n: progress.progress(n / max(1, len(guests)), text=f"{n} of {len(guests)} cards generated")
+                        if bulk_format.endswith("(vector text)"):
+                            count = write_cards_pdf_vector(st.session_state.card_type, st.session_state.card_data, guests, output, on_card)
+                            file_name, mime = "cards.pdf", "application/pdf"
+                        elif bulk_format.startswith("ZIP"):
+                            cards = iter_bulk_cards(st.session_state.card_type, st.session_state.card_data, guests)
+                            count = write_cards_zip(cards, output, on_card)
+                            file_name, mime = "cards.zip", "application/zip"
+                        else:
+                            cards = iter_bulk_cards(st.session_state.card_type, st.session_state.card_data, guests)
+                            count = write_cards_pdf(cards, output, on_card)
+                            file_name, mime = "cards.pdf", "application/pdf"
+                        progress.progress(1.0, text=f"{count} cards generated")
+                        output.seek(0)
+                        if count:
+                            st.download_button(f"📥 Download {count} Cards", data=output.read(), file_name=file_name, mime=mime)
+                        else:
+                            st.warning("No guests found in the uploaded file.")
+
 # ==========================================
-# 7. MAIN NAVIGATION
+# 10. MAIN NAVIGATION
 # ==========================================
 def main():
+    configure_page()
+    init_session_state()
     st.sidebar.title("Navigation")
     app_choice = st.sidebar.radio("Go to:", ["Chat2Comic", "AI Card Generator"])
     
@@ -775,6 +3545,8 @@ def main():
         
     st.sidebar.markdown("---")
     st.sidebar.info("Creative AI Studio | Combined App v1.0")
+    record_startup_metric('cold_start_s', time.perf_counter() - _SCRIPT_STARTED)
+    record_startup_metric('last_rerun_s', time.perf_counter() - _SCRIPT_STARTED, first_only=False)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# main.py reads its settings at import time: keep the render cache, saved chats and the asset pack
+# out of the user's home directory
+os.environ.setdefault("RENDER_CACHE_DIR", tempfile.mkdtemp(prefix="chat2comic-tests-"))
+os.environ.setdefault("ASSET_PACK", "")
+os.environ.setdefault("SAVE_CONVERSATIONS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from streamlit import logger as st_logger
+
+import main as app
+
+st_logger.set_log_level("error")
+
+class StubDetector:
+    # Same call signature as the transformers pipeline; records each batch it is given
+    def __init__(self):
+        self.calls = []
+        self.error = None
+
+    def __call__(self, texts, batch_size=1, **kwargs):
+        self.calls.append(list(texts))
+        if self.error:
+            raise self.error
+        return [{'label': "JOY" if "happy" in text else "NEUTRAL", 'score': 1.0} for text in texts]
+
+@pytest.fixture
+def detector():
+    stub = StubDetector()
+    app.set_emotion_detector(stub)
+    app.get_emotion_errors().clear()
+    yield stub
+    app.set_emotion_detector(None)
+    app.get_emotion_errors().clear()
@@ -0,0 +1,84 @@
+import json
+import os
+
+import pytest
+from PIL import Image, ImageDraw
+
+import main as app
+
+PAGE = (80, 60)
+
+@pytest.mark.parametrize("path, kind", [
+    ("bg-1.jpg", ('background', None)),
+    ("backgrounds/park.png", ('background', None)),
+    ("Girl/Girl Joy.jpg", ('character', 'female_joy')),
+    ("male_sad.png", ('character', 'male_sadness')),
+    ("woman-angry.webp", ('character', 'female_anger')),
+    ("notes.png", None),
+])
+def test_classify_asset(path, kind):
+    assert app.classify_asset(path) == kind
+
+def make_assets(directory):
+    background = Image.new('RGB', (400, 300), (30, 120, 200))
+    ImageDraw.Draw(background).rectangle([50, 40, 250, 200], fill=(250, 200, 10))
+    background.save(directory / "bg-1.png")
+    # Transparent margin around the opaque figure, which the pack trims away
+    character = Image.new('RGBA', (100, 120), (0, 0, 0, 0))
+    ImageDraw.Draw(character).rectangle([10, 20, 59, 99], fill=(200, 30, 30, 255))
+    character.save(directory / "male_joy.png")
+    Image.new('RGBA', (400, 200), (0, 90, 0, 255)).save(directory / "female_angry.png")
+    (directory / "spare").mkdir()
+    character.save(directory / "spare" / "male_happy.png")
+    Image.new('RGB', (10, 10)).save(directory / "notes.png")
+    (directory / "female_sad.png").write_bytes(b"not an image")
+    return background, character
+
+def test_pack_round_trip(tmp_path):
+    assets = tmp_path / "images"
+    assets.mkdir()
+    background, character = make_assets(assets)
+    pack_path = str(tmp_path / "assets.pack")
+    index = app.build_asset_pack(str(assets), pack_path, page_size=PAGE, max_size=100)
+    assert sorted(index['skipped']) == sorted(["female_sad.png", "notes.png", os.path.join("spare", "male_happy.png")])
+
+    pack = app.AssetPack(pack_path)
+    assert pack.page_size == PAGE
+    assert pack.digest == index['digest']
+    assert len(pack.backgrounds) == 1
+    assert pack.backgrounds[0].tobytes() == background.resize(PAGE, Image.Resampling.LANCZOS).tobytes()
+
+    joy = pack.character('male', 'joy')
+    assert joy.mode == 'RGBA' and joy.size == (50, 80)
+    assert joy.tobytes() == character.crop((10, 20, 60, 100)).tobytes()
+    assert pack.character('female', 'anger').size == (100, 50)
+    assert pack.character('male', 'sadness') is None
+
+    assert pack.background_index(3, PAGE) == 0
+    assert pack.background_index(0, (800, 600)) is None
+
+def test_pack_from_another_version_is_rejected(tmp_path):
+    pack_path = str(tmp_path / "assets.pack")
+    index = app.build_asset_pack(str(tmp_path), pack_path, page_size=PAGE)
+    assert index['characters'] == {} and index['backgrounds'] == []
+    with open(pack_path + '.json', 'w', encoding='utf-8') as f:
+        json.dump(dict(index, version=app.ASSET_PACK_VERSION + 1), f)
+    with pytest.raises(ValueError):
+        app.AssetPack(pack_path)
+
+@pytest.fixture
+def packed_assets(tmp_path, monkeypatch):
+    make_assets(tmp_path)
+    pack_path = str(tmp_path / "assets.pack")
+    app.build_asset_pack(str(tmp_path), pack_path)
+    monkeypatch.setattr(app, "ASSET_PACK", pack_path)
+    app.get_asset_pack.clear()
+    yield app.get_asset_pack()
+    monkeypatch.undo()
+    app.get_asset_pack.clear()
+
+def test_renderer_reads_from_the_pack(packed_assets):
+    assert packed_assets is not None
+    assert app.get_character_image('male', 'joy') is packed_assets.characters['male_joy']
+    assert app.get_background_image(5) is packed_assets.backgrounds[0]
+    assert app.get_background_image(0).size == app.PAGE_SIZE
@@ -0,0 +1,50 @@
+import threading
+from collections import OrderedDict
+
+import main as app
+from conftest import StubDetector
+
+def test_process_caches_outlive_a_call():
+    assert app.get_emotion_memo() is app.get_emotion_memo()
+    assert app.get_emotion_batcher() is app.get_emotion_batcher()
+
+def test_duplicate_texts_are_classified_once(detector):
+    assert app.detect_emotions(["I am happy", "I am   happy", "it rains"]) == ["joy", "joy", "neutral"]
+    assert detector.calls == [["I am happy", "it rains"]]
+
+def test_memoized_texts_skip_the_model(detector):
+    app.detect_emotions(["I am happy"])
+    assert app.detect_emotions([" I am happy ", "new text"]) == ["joy", "neutral"]
+    assert detector.calls == [["I am happy"], ["new text"]]
+    assert app.cached_emotion("I am happy") == "joy"
+
+def test_failed_inference_falls_back_without_memoizing(detector):
+    detector.error = RuntimeError("out of memory")
+    assert app.detect_emotions(["I am happy"]) == ["neutral"]
+    assert "out of memory" in app.get_emotion_errors()['inference']
+    assert app.cached_emotion("I am happy") is None
+
+    detector.error = None
+    assert app.detect_emotions(["I am happy"]) == ["joy"]
+    assert 'inference' not in app.get_emotion_errors()
+    assert len(detector.calls) == 2
+
+def test_batcher_groups_concurrent_submits():
+    stub = StubDetector()
+    memo = (OrderedDict(), threading.Lock())
+    batcher = app.EmotionBatcher(max_batch=8, max_wait=0.5, emotion_detector=stub, memo=memo)
+    futures = [batcher.submit(text) for text in ("I am happy", "it rains", "so happy")]
+    assert [future.result(timeout=5) for future in futures] == ["joy", "neutral", "joy"]
+    assert stub.calls == [["I am happy", "it rains", "so happy"]]
+    assert len(memo[0]) == 3
+
+    # Served from the batcher's memo without queueing another batch
+    assert batcher.submit("I am happy").result(timeout=0) == "joy"
+    assert batcher.stats()['batches'] == 1
+
+def test_batcher_caps_batch_size():
+    stub = StubDetector()
+    batcher = app.EmotionBatcher(max_batch=2, max_wait=0.5, emotion_detector=stub, memo=(OrderedDict(), threading.Lock()))
+    futures = [batcher.submit(f"message {i}") for i in range(5)]
+    assert [future.result(timeout=5) for future in futures] == ["neutral"] * 5
+    assert [len(batch) for batch in stub.calls] == [2, 2, 1]
@@ -0,0 +1,110 @@
+import io
+import random
+
+import pytest
+from PIL import Image
+
+import main as app
+
+def noise_image(size, seed=0):
+    rng = random.Random(seed)
+    return Image.frombytes('RGB', size, bytes(rng.randrange(256) for _ in range(size[0] * size[1] * 3)))
+
+def bands(image, rows):
+    width, height = image.size
+    return (image.crop((0, top, width, min(top + rows, height))) for top in range(0, height, rows))
+
+def test_png_bands_round_trip():
+    image = noise_image((37, 23))
+    buffer = io.BytesIO()
+    app.write_png_bands(buffer, image.size, bands(image, 8), dpi=150)
+    decoded = Image.open(io.BytesIO(buffer.getvalue()))
+    assert decoded.format == 'PNG' and decoded.mode == 'RGB'
+    assert decoded.tobytes() == image.tobytes()
+    assert decoded.info['dpi'] == pytest.approx((150, 150), abs=0.1)
+
+def test_tiff_bands_round_trip():
+    image = noise_image((37, 23))
+    buffer = io.BytesIO()
+    app.write_tiff_bands(buffer, image.size, bands(image, 8), dpi=150, band_rows=8)
+    decoded = Image.open(io.BytesIO(buffer.getvalue()))
+    assert decoded.format == 'TIFF' and decoded.mode == 'RGB'
+    assert decoded.tobytes() == image.tobytes()
+    assert decoded.info['dpi'] == pytest.approx((150, 150))
+
+def pdf_images(data):
+    pypdf = pytest.importorskip("pypdf")
+    reader = pypdf.PdfReader(io.BytesIO(data))
+    return reader.pages, [page['/Resources']['/XObject']['/Im0'].get_object() for page in reader.pages]
+
+def test_streaming_pdf_writer():
+    image = noise_image((40, 30))
+    png, jpeg = io.BytesIO(), io.BytesIO()
+    image.save(png, format='PNG')
+    image.save(jpeg, format='JPEG')
+    buffer = io.BytesIO()
+    writer = app.StreamingPdfWriter(buffer)
+    writer.add_page(png.getvalue())
+    writer.add_page(image)
+    writer.add_page(jpeg.getvalue())
+    writer.add_image_page(image.size, bands(image, 7), (200.0, 150.0))
+    assert writer.close() == 4
+
+    pages, images = pdf_images(buffer.getvalue())
+    assert len(pages) == 4
+    assert [float(v) for v in pages[0].mediabox] == pytest.approx([0, 0, *app.PDF_PAGE_SIZE])
+    assert [float(v) for v in pages[3].mediabox] == pytest.approx([0, 0, 200, 150])
+    for xobject in images:
+        assert (xobject['/Width'], xobject['/Height']) == image.size
+    for i in (0, 1, 3):
+        assert xobject_filter(images[i]) == '/FlateDecode'
+        assert images[i].get_data() == image.tobytes()
+    # JPEG pages are embedded as they are
+    assert xobject_filter(images[2]) == '/DCTDecode'
+    assert images[2].get_data() == jpeg.getvalue()
+
+def xobject_filter(xobject):
+    return str(xobject['/Filter'])
+
+def test_streaming_pdf_writer_jpeg_encoding():
+    image = noise_image((40, 30))
+    buffer = io.BytesIO()
+    writer = app.StreamingPdfWriter(buffer, encoding='jpeg', quality=70)
+    writer.add_page(image)
+    assert writer.close() == 1
+    _, images = pdf_images(buffer.getvalue())
+    assert xobject_filter(images[0]) == '/DCTDecode'
+    assert Image.open(io.BytesIO(images[0].get_data())).size == image.size
+
+def test_streaming_pdf_writer_rejects_unknown_encoding():
+    with pytest.raises(ValueError):
+        app.StreamingPdfWriter(io.BytesIO(), encoding='webp')
+
+WISHES = {'festival_name': 'Diwali', 'sender_name': 'Alex', 'receiver_name': 'Sam', 'personal_message': 'Happy Diwali!'}
+
+def render_print(fmt):
+    buffer = io.BytesIO()
+    size = app.render_print_card('wishes', WISHES, buffer, fmt, 'A6', dpi=50, supersample=1, band_rows=32)
+    return size, buffer.getvalue()
+
+def test_render_print_card_formats_agree():
+    pixel_size, _, page_size = app.print_card_geometry('wishes', 'A6', 50)
+    # Landscape card on landscape A6
+    assert pixel_size == (291, 207)
+
+    size, png = render_print('png')
+    assert size == pixel_size
+    printed = Image.open(io.BytesIO(png))
+    assert printed.size == pixel_size
+    _, tiff = render_print('tiff')
+    assert Image.open(io.BytesIO(tiff)).tobytes() == printed.tobytes()
+
+    _, pdf = render_print('pdf')
+    pages, images = pdf_images(pdf)
+    assert len(pages) == 1
+    assert [float(v) for v in pages[0].mediabox] == pytest.approx([0, 0, *page_size], abs=1e-3)
+    assert images[0].get_data() == printed.convert('RGB').tobytes()
+
+def test_render_print_card_rejects_unknown_format():
+    with pytest.raises(ValueError):
+        app.render_print_card('wishes', WISHES, io.BytesIO(), 'gif')
@@ -0,0 +1,87 @@
+import io
+import tracemalloc
+
+import pytest
+
+import main as app
+
+GENDERS = {'User A': 'male', 'User B': 'female'}
+
+def parse(text, fmt):
+    return list(app.iter_transcript_stream(io.StringIO(text, newline=''), fmt))
+
+def test_json_transcript():
+    text = ('{"messages": [{"speaker": "Ana", "message": "Hi", "emotion": "Joy"}, ["Ben", "Hello"],'
+            ' {"user": "Ana", "text": "  "}, {"name": "Ben", "text": "Bye", "emotion": ""}]}')
+    assert parse(text, 'json') == [("Ana", "Hi", "joy"), ("Ben", "Hello", None), ("Ben", "Bye", None)]
+    assert parse('[["Ana", "Hi", "anger"]]', 'json') == [("Ana", "Hi", "anger")]
+
+def test_csv_transcript():
+    text = 'Speaker , Message,Emotion\r\nAna,"Hi, there",\r\nBen,"two\nlines",Anger\r\nAna,,\r\n'
+    assert parse(text, 'csv') == [("Ana", "Hi, there", None), ("Ben", "two\nlines", "anger")]
+
+def test_whatsapp_transcript():
+    text = (
+        "12/31/20, 10:14 PM - Messages and calls are end-to-end encrypted. No one outside of this chat can read them.\n"
+        "12/31/20, 10:15 PM - Ana: Happy new year\n"
+        "see you soon\n"
+        "12/31/20, 10:16 PM - Ben: Thanks!\n"
+        "[31/12/2020, 22:17:03] Ana: iOS export\n"
+        "\u200e[31/12/2020, 22:18:00] Ben: time: late\n"
+    )
+    assert parse(text, 'whatsapp') == [
+        ("Ana", "Happy new year\nsee you soon", None),
+        ("Ben", "Thanks!", None),
+        ("Ana", "iOS export", None),
+        ("Ben", "time: late", None),
+    ]
+
+def test_unknown_transcript_format():
+    with pytest.raises(ValueError):
+        parse("", 'xml')
+
+def test_iter_speakers_maps_two_speakers_and_counts_the_rest():
+    entries = [("Ana", "1", None), ("Ben", "2", "joy"), ("Cid", "3", None), ("Ana", "4", None)]
+    stats = {}
+    assert list(app.iter_speakers(entries, stats=stats)) == [
+        ("User A", "1", None), ("User B", "2", "joy"), ("User A", "4", None)]
+    assert stats == {'skipped': 1}
+    messages, skipped = app.map_speakers(entries, speaker_a="Ben")
+    assert [speaker for speaker, _, _ in messages] == ["User B", "User A", "User B"]
+    assert skipped == 1
+
+def test_message_pairs():
+    assert list(app.iter_message_pairs(iter(range(5)))) == [[0, 1], [2, 3], [4]]
+
+def conversation(pages):
+    emotions = ("joy", "sadness", "anger", "neutral")
+    for i in range(pages * 2):
+        yield app.SPEAKERS[i % 2], f"Message {i}: " + "the quick brown fox " * 4, emotions[i % len(emotions)]
+
+def vector_pdf_peak(pages, path):
+    tracemalloc.start()
+    try:
+        with open(path, 'wb') as output:
+            counts = app.stream_comic_vector(conversation(pages), GENDERS, output, use_model=False)
+        return counts, tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+def test_stream_comic_vector_memory_does_not_grow_per_page(tmp_path, monkeypatch):
+    # Without asset files every page draws freshly made fallback characters, the case that used to
+    # keep one image and its decoded pixels per page alive until the document was saved
+    monkeypatch.setattr(app, "CHARACTER_IMAGES", {})
+    monkeypatch.setattr(app, "BACKGROUND_IMAGES", [])
+    vector_pdf_peak(2, tmp_path / "warmup.pdf")
+
+    short_counts, short_peak = vector_pdf_peak(10, tmp_path / "short.pdf")
+    long_counts, long_peak = vector_pdf_peak(60, tmp_path / "long.pdf")
+    assert short_counts == {'messages': 20, 'pages': 10}
+    assert long_counts == {'messages': 120, 'pages': 60}
+    # The canvas keeps each page's drawing operators until save(), a few KB a page; the decoded
+    # fallback characters alone were ~400 KB a page
+    assert long_peak - short_peak < 4 * 1024 * 1024
+
+    pypdf = pytest.importorskip("pypdf")
+    reader = pypdf.PdfReader(str(tmp_path / "long.pdf"))
+    assert len(reader.pages) == 60